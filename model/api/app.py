@@ -1,18 +1,47 @@
-import sys
 import os
 import json
-from flask import Flask, request, jsonify
+import hashlib
+from flask import Flask, Response, request, jsonify
 import datetime
 from metrics.division import split_image, delete_directory  # Ensure this imports correctly
 from deepface_model.main import recognize_faces_in_directory  # Now this should work
+from deepface_model.engines import get_engine
 from flask_cors import CORS
 from api.email_sending import send_attendance_emails  # Ensure this imports correctly
+from api.outbox import get_outbox
+from api.attendance import get_attendance_store, session_key
+from api.jobs import JobQueue, QueueFull
+from deepface_model.roster import get_roster
+from deepface_model.video import recognize_faces_in_video
+from deepface_model.warmup import readiness, start_warm_up
+from metrics.telemetry import IN_FLIGHT, UPLOAD_BYTES, render_metrics, span
 
 app = Flask(__name__)
 
 # Folder to temporarily save uploaded images
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
+GRID_SIZES = (3, 4)
+TIMESTAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+# Tiles are kept in memory by default; set SAVE_TILES=1 to write uploads and
+# tiles to disk for debugging (the original split_image/output folder flow).
+SAVE_TILES = os.getenv("SAVE_TILES", "0") == "1"
+
+# Uploads are queued as background jobs when the request asks for it
+# (async=1) or when ASYNC_UPLOADS=1 makes that the default
+ASYNC_UPLOADS = os.getenv("ASYNC_UPLOADS", "0") == "1"
+
+# Classroom videos always run as background jobs; larger uploads get 413
+VIDEO_MAX_BYTES = int(os.getenv("VIDEO_MAX_MB", "500")) * 1024 * 1024
+
+class NothingProcessed(Exception):
+    """None of the uploaded images (or video frames) could be processed, so no session is recorded."""
+
+
+# Recognition backend for uploads, from RECOGNITION_ENGINE (see deepface_model/engines.py);
+# an unknown name fails here, at startup
+recognition_engine = get_engine()
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
@@ -43,8 +72,147 @@ CORS(app, origins=[
     "http://localhost:3001"
 ], supports_credentials=True)
 
+def recognize_uploads_on_disk(uploads, user_name, subject_name, timestamp, stats=None):
+    # Debug mode: save uploads and tiles so they can be inspected, then clean up
+    user_output_folder = os.path.join(OUTPUT_FOLDER, f"{user_name}_{timestamp}")
+    os.makedirs(user_output_folder, exist_ok=True)
+
+    image_paths = []
+    for filename, data in uploads:
+        image_filename = os.path.join(UPLOAD_FOLDER, filename)
+        with open(image_filename, 'wb') as f:
+            f.write(data)
+        image_paths.append(image_filename)
+
+    with span("split_image"):
+        for image_path in image_paths:
+            split_image(image_path, user_output_folder, grid_sizes=GRID_SIZES)
+
+    result = recognize_faces_in_directory(user_output_folder, subject=subject_name, stats=stats)
+
+    # Delete the output folder after processing
+    delete_directory(user_output_folder)
+    return result
+
+def process_uploads(uploads, user_name, subject_name, timestamp, session_id=None):
+    """Recognize faces in a list of (filename, bytes) uploads and notify parents.
+
+    Shared by the synchronous /upload path and the background job workers.
+    The session is keyed by session_id when the client sent one, else by the
+    image contents, so resubmitting the same photos records nothing new.
+    Raises NothingProcessed if no image could be processed and ValueError if
+    the result cannot be serialized.
+    """
+    stats = {}
+    UPLOAD_BYTES.observe(sum(len(data) for _, data in uploads))
+
+    if SAVE_TILES:
+        face_recognition_result = recognize_uploads_on_disk(uploads, user_name, subject_name, timestamp, stats=stats)
+    else:
+        # Uploads are decoded and tiled as NumPy views; nothing touches disk
+        face_recognition_result = recognition_engine.recognize_uploads(uploads, GRID_SIZES, stats=stats, subject=subject_name)
+
+    if not stats.get("tiles"):
+        raise NothingProcessed("None of the uploaded images could be processed")
+
+    session_parts = [f"client:{session_id}"] if session_id else [hashlib.sha256(data).hexdigest() for _, data in uploads]
+    recognized_faces, session = notify_attendance(face_recognition_result, user_name, subject_name, timestamp, session_parts)
+    return {"recognized_faces": recognized_faces, "session_id": session, "stats": stats}
+
+def notify_attendance(face_recognition_result, user_name, subject_name, timestamp, session_parts):
+    """Sanitize and validate a recognition result, record the session, then queue the parent emails.
+
+    Only students new to the session are emailed. Returns (recognized faces, session id).
+    """
+    # Sanitize the face recognition result
+    face_recognition_result = sanitize_face_recognition_result(face_recognition_result)
+
+    # Log the face recognition result
+    print("Face recognition result:", face_recognition_result)
+
+    # Validate the response data
+    if not validate_json(face_recognition_result):
+        raise ValueError("Invalid JSON response")
+
+    class_date = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT).date().isoformat()
+    session_id = session_key(subject_name, class_date, session_parts)
+    # If recording fails, everyone is emailed as before rather than no one
+    new_faces = face_recognition_result
+    try:
+        with span("attendance_record"):
+            session_id, new_faces = get_attendance_store().record(
+                subject_name, class_date, timestamp, user_name, face_recognition_result, session_id)
+    except Exception as e:
+        print(f"[ERROR] Recording attendance failed: {e}")
+
+    if len(new_faces) < len(face_recognition_result):
+        print(f"[Info] Session {session_id} already recorded {len(face_recognition_result) - len(new_faces)} of these students")
+
+    try:
+        with span("email_dispatch"):
+            send_attendance_emails(new_faces, subject=subject_name, class_time=timestamp)
+    except Exception as e:
+        print(f"[ERROR] Sending emails failed: {e}")
+
+    return face_recognition_result, session_id
+
+def process_video(video_path, user_name, subject_name, timestamp, session_id=None):
+    """Recognize the students in a saved video and notify parents, like process_uploads."""
+    stats = {}
+    try:
+        face_recognition_result = recognize_faces_in_video(video_path, stats=stats, subject=subject_name)
+    except ValueError as e:
+        raise NothingProcessed(str(e))
+    # matched_tracks is only reported once the tracks were embedded and matched
+    if not stats.get("sampled_frames") or "matched_tracks" not in stats:
+        raise NothingProcessed("No frame of the video could be processed")
+
+    if session_id:
+        session_parts = [f"client:{session_id}"]
+    else:
+        digest = hashlib.sha256()
+        with open(video_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        session_parts = [digest.hexdigest()]
+    recognized_faces, session = notify_attendance(face_recognition_result, user_name, subject_name, timestamp, session_parts)
+    return {"recognized_faces": recognized_faces, "session_id": session, "stats": stats}
+
+def run_job(uploads, kind="images", **payload):
+    """Job queue handler: photo uploads get (filename, bytes), a video job gets (filename, path)."""
+    if kind == "video":
+        (_, video_path), = uploads
+        return process_video(video_path, **payload)
+    return process_uploads(uploads, **payload)
+
+job_queue = JobQueue(run_job)
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    # Also starts the warm-up when the server did not run gunicorn's post_fork hook
+    start_warm_up()
+    state = readiness()
+    body = {
+        "status": "ready" if state["ready"] else "warming",
+        "error": state["error"],
+        "timings": state["timings"],
+    }
+    return jsonify(body), 200 if state["ready"] else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 def upload_images():
+    with IN_FLIGHT.track_inprogress(kind="request"):
+        return handle_upload()
+
+def handle_upload():
     # Get the name from the form data
     user_name = request.form.get('name')
     if not user_name:
@@ -53,11 +221,6 @@ def upload_images():
     if not subject_name:
         return jsonify({"error": "Subject name is required"}), 400
 
-    # Create a directory named after the user and the current timestamp
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    user_output_folder = os.path.join(OUTPUT_FOLDER, f"{user_name}_{timestamp}")
-    os.makedirs(user_output_folder, exist_ok=True)
-
     # Limit: Max 6 images
     images = request.files.getlist('images')
     if len(images) > 6:
@@ -66,41 +229,125 @@ def upload_images():
     if not images:
         return jsonify({"error": "No images uploaded"}), 400
 
-    # Save uploaded images to the server
-    image_paths = []
-    for image in images:
-        image_filename = os.path.join(UPLOAD_FOLDER, image.filename)
-        image.save(image_filename)
-        image_paths.append(image_filename)
+    timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    uploads = [(image.filename, image.read()) for image in images]
+    # Optional client key for the class session; uploads sharing it add to one session
+    session_id = request.form.get('session_id') or None
 
-    # Call split_image function for each image
-    for image_path in image_paths:
-        split_image(image_path, user_output_folder, grid_size=3)
-        split_image(image_path, user_output_folder, grid_size=4)
+    run_async = request.values.get('async', '1' if ASYNC_UPLOADS else '0').lower() in ('1', 'true', 'yes')
+    if run_async:
+        try:
+            job_id = job_queue.submit(uploads, user_name=user_name, subject_name=subject_name, timestamp=timestamp,
+                                      session_id=session_id)
+        except QueueFull as e:
+            print(f"[ERROR] Upload rejected, job queue is full: {e}")
+            response = jsonify({"error": "Too many uploads in progress, please retry shortly"})
+            response.headers['Retry-After'] = '30'
+            return response, 429
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
 
-    # Call recognition_faces_in_directory function from main.py
-    face_recognition_result = recognize_faces_in_directory(user_output_folder)
+    try:
+        result = process_uploads(uploads, user_name, subject_name, timestamp, session_id)
+    except NothingProcessed as e:
+        return jsonify({"error": str(e)}), 422
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
 
-    # Sanitize the face recognition result
-    face_recognition_result = sanitize_face_recognition_result(face_recognition_result)
+    # Return the list of recognized faces in the response
+    return jsonify(result)
 
-    # Log the face recognition result
-    print("Face recognition result:", face_recognition_result)
+@app.route('/upload_video', methods=['POST'])
+def upload_video():
+    with IN_FLIGHT.track_inprogress(kind="request"):
+        return handle_video_upload()
 
-    # Validate the response data
-    if not validate_json(face_recognition_result):
-        return jsonify({"error": "Invalid JSON response"}), 500
+def handle_video_upload():
+    # Checked while the body is read, so an oversized video is never spooled in full
+    request.max_content_length = VIDEO_MAX_BYTES
 
+    user_name = request.form.get('name')
+    if not user_name:
+        return jsonify({"error": "Name is required"}), 400
+    subject_name = request.form.get('subject_name')
+    if not subject_name:
+        return jsonify({"error": "Subject name is required"}), 400
+
+    video = request.files.get('video')
+    if video is None or not video.filename:
+        return jsonify({"error": "No video uploaded"}), 400
+
+    timestamp = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    session_id = request.form.get('session_id') or None
+
+    # A lecture-length video takes longer than a request may, so it is always queued;
+    # the job gets the file's path, since OpenCV decodes from a path
     try:
-        send_attendance_emails(face_recognition_result, subject=subject_name, class_time=timestamp)
-    except Exception as e:
-        print(f"[ERROR] Sending emails failed: {e}")
+        job_id = job_queue.submit([(video.filename, video.stream)], as_paths=True, kind="video", user_name=user_name,
+                                  subject_name=subject_name, timestamp=timestamp, session_id=session_id)
+    except QueueFull as e:
+        print(f"[ERROR] Video rejected, job queue is full: {e}")
+        response = jsonify({"error": "Too many uploads in progress, please retry shortly"})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
 
-    # Delete the output folder after processing
-    delete_directory(user_output_folder)
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
-    # Return the list of recognized faces in the response
-    return jsonify({"recognized_faces": face_recognition_result})
+def parse_date_arg(name):
+    """Optional YYYY-MM-DD query argument; raises ValueError when malformed."""
+    value = request.args.get(name)
+    if value:
+        datetime.date.fromisoformat(value)
+    return value
+
+@app.route('/attendance/students/<student>', methods=['GET'])
+def student_attendance(student):
+    # The path is a UIN, or a name for students without one
+    roster = get_roster()
+    known = roster.by_uin(student) or roster.get(student)
+    uin = known["uin"] if known else None
+    try:
+        report = get_attendance_store().student_report(
+            uin=uin, name=None if uin else (known["name"] if known else student),
+            subject=request.args.get('subject'), start=parse_date_arg('from'), end=parse_date_arg('to'),
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+    if known:
+        report["name"] = known["name"]
+    return jsonify(report)
+
+@app.route('/attendance/subjects/<subject>/days', methods=['GET'])
+def subject_attendance_days(subject):
+    try:
+        days = get_attendance_store().subject_days(subject, start=parse_date_arg('from'), end=parse_date_arg('to'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+    return jsonify({"subject": subject, "days": days})
+
+@app.route('/attendance/subjects/<subject>/days/<class_date>', methods=['GET'])
+def subject_attendance_day(subject, class_date):
+    try:
+        datetime.date.fromisoformat(class_date)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    summary = get_attendance_store().subject_day(subject, class_date)
+    # Absentees can only be listed when the roster says who takes the subject
+    enrolled = get_roster().students_in(subject)
+    if enrolled:
+        present = {student["name"] for student in summary["present"]}
+        summary["absent"] = [{"name": student["name"], "uin": student["uin"]}
+                             for student in enrolled if student["name"] not in present]
+    return jsonify(summary)
 
 if __name__ == '__main__':
+    start_warm_up()
+    job_queue.start()
+    get_outbox().start()
     app.run(port=8000, debug=True)
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Append-only attendance log. Every upload in which at least one image was
+# processed is one class session and every recognized student one row, written
+# together in a single transaction. Session ids are derived from the subject,
+# the class day, and the uploaded content (or a client-supplied key), so a
+# resubmitted photo or a retried job lands in the session it already created.
+# WAL mode lets the reporting endpoints read while workers append, and the
+# (subject, class_date) and (uin, class_date) indexes, which also cover the
+# columns the reports read, keep them to index range scans over a full
+# academic year.
+
+ATTENDANCE_DB = os.getenv("ATTENDANCE_DB", "attendance.db")
+
+
+def session_key(subject, class_date, parts):
+    """Deterministic session id for a subject, a class day, and the upload's content hashes or client key."""
+    digest = hashlib.sha256(f"{subject}\0{class_date}".encode())
+    for part in sorted(parts):
+        digest.update(b"\0" + part.encode())
+    return digest.hexdigest()[:32]
+
+
+class AttendanceStore:
+    def __init__(self, db_path=ATTENDANCE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                subject TEXT NOT NULL,
+                class_date TEXT NOT NULL,
+                class_time TEXT NOT NULL,
+                teacher TEXT,
+                recorded_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions (id),
+                subject TEXT NOT NULL,
+                class_date TEXT NOT NULL,
+                name TEXT NOT NULL,
+                uin TEXT,
+                recorded_at REAL NOT NULL,
+                UNIQUE (session_id, name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_subject_date ON sessions (subject, class_date);
+            CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions (class_date);
+            CREATE INDEX IF NOT EXISTS idx_attendance_subject_date ON attendance (subject, class_date, name);
+            CREATE INDEX IF NOT EXISTS idx_attendance_uin_date ON attendance (uin, class_date, subject, session_id);
+            CREATE INDEX IF NOT EXISTS idx_attendance_name_date ON attendance (name, class_date, subject, session_id);
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # WAL makes NORMAL durable against application crashes, which is enough here
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, subject, class_date, class_time, teacher, faces, session_id=None):
+        """Record one session and its recognized faces in a single transaction.
+
+        class_date is an ISO date (YYYY-MM-DD), which the reports filter and group on.
+        Recording an existing session_id again (see session_key) adds nothing but
+        students it did not have yet. Returns (session_id, faces newly recorded).
+        """
+        session_id = session_id or uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, subject, class_date, class_time, teacher, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, subject, class_date, class_time, teacher, now),
+            )
+            added = []
+            for face in faces:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO attendance (session_id, subject, class_date, name, uin, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (session_id, subject, class_date, face["name"], face.get("uin"), now),
+                )
+                if cursor.rowcount:
+                    added.append(face)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return session_id, added
+
+    def student_report(self, uin=None, name=None, subject=None, start=None, end=None):
+        """Sessions held and attended per subject for one student (by UIN, else by name)."""
+        if uin is None and name is None:
+            raise ValueError("A UIN or a name is required")
+        start, end = start or "0000-00-00", end or "9999-12-31"
+        conn = self._connect()
+
+        student_column, student = ("uin", uin) if uin is not None else ("name", name)
+        subject_filter, subject_args = ("AND subject = ?", (subject,)) if subject else ("", ())
+        attended = dict(conn.execute(
+            f"SELECT subject, COUNT(DISTINCT session_id) FROM attendance "
+            f"WHERE {student_column} = ? AND class_date BETWEEN ? AND ? {subject_filter} GROUP BY subject",
+            (student, start, end, *subject_args),
+        ).fetchall())
+        held = dict(conn.execute(
+            f"SELECT subject, COUNT(*) FROM sessions WHERE class_date BETWEEN ? AND ? {subject_filter} GROUP BY subject",
+            (start, end, *subject_args),
+        ).fetchall())
+
+        subjects = []
+        for subject_name in sorted(set(held) | set(attended)):
+            sessions = held.get(subject_name, 0)
+            present = attended.get(subject_name, 0)
+            subjects.append({
+                "subject": subject_name,
+                "sessions": sessions,
+                "attended": present,
+                "percentage": round(100.0 * present / sessions, 1) if sessions else None,
+            })
+
+        sessions = sum(item["sessions"] for item in subjects)
+        present = sum(item["attended"] for item in subjects)
+        return {
+            "uin": uin,
+            "name": name,
+            "from": start,
+            "to": end,
+            "subjects": subjects,
+            "percentage": round(100.0 * present / sessions, 1) if sessions else None,
+        }
+
+    def subject_days(self, subject, start=None, end=None):
+        """One summary per class day: sessions held and distinct students present."""
+        start, end = start or "0000-00-00", end or "9999-12-31"
+        conn = self._connect()
+        present = dict(conn.execute(
+            "SELECT class_date, COUNT(DISTINCT name) FROM attendance "
+            "WHERE subject = ? AND class_date BETWEEN ? AND ? GROUP BY class_date",
+            (subject, start, end),
+        ).fetchall())
+        rows = conn.execute(
+            "SELECT class_date, COUNT(*) FROM sessions "
+            "WHERE subject = ? AND class_date BETWEEN ? AND ? GROUP BY class_date ORDER BY class_date",
+            (subject, start, end),
+        ).fetchall()
+        return [{"date": date, "sessions": sessions, "present": present.get(date, 0)} for date, sessions in rows]
+
+    def subject_day(self, subject, class_date):
+        """Sessions of a subject on one day with the students recognized in each."""
+        conn = self._connect()
+        sessions = [dict(row) | {"students": []} for row in conn.execute(
+            "SELECT id, class_time, teacher FROM sessions WHERE subject = ? AND class_date = ? ORDER BY class_time",
+            (subject, class_date),
+        )]
+        by_id = {session["id"]: session for session in sessions}
+        for row in conn.execute(
+            "SELECT session_id, name, uin FROM attendance WHERE subject = ? AND class_date = ? ORDER BY name",
+            (subject, class_date),
+        ):
+            by_id[row["session_id"]]["students"].append({"name": row["name"], "uin": row["uin"]})
+
+        present = sorted({(student["name"], student["uin"]) for session in sessions for student in session["students"]})
+        return {
+            "subject": subject,
+            "date": class_date,
+            "sessions": sessions,
+            "present": [{"name": name, "uin": uin} for name, uin in present],
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_attendance_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AttendanceStore()
+    return _store
@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from metrics.telemetry import IN_FLIGHT
+
+# Local, broker-less job queue for asynchronous /upload and /upload_video
+# requests. Jobs live in
+# a SQLite file so that every gunicorn worker (and an optional standalone
+# worker process) sees the same queue; claiming a job is a single atomic
+# UPDATE, so a job is only ever run by one worker.
+
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOBS_FOLDER = os.getenv("JOBS_FOLDER", os.path.join("uploads", "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))
+# A running job's updated_at is touched this often; one not touched for
+# JOB_STALE_SECONDS belongs to a dead worker and is queued again
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+POLL_INTERVAL = 0.5
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, handler, db_path=JOBS_DB, jobs_folder=JOBS_FOLDER, workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS):
+        self.handler = handler
+        self.db_path = db_path
+        self.jobs_folder = jobs_folder
+        self.workers = workers
+        self.max_queued = max_queued
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+        os.makedirs(jobs_folder, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Start the worker threads in this process (once per process, so it is fork-safe)."""
+        with self._lock:
+            if self._started_pid == os.getpid() or self.workers <= 0:
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True).start()
+            print(f"[Info] Started {self.workers} job workers (pid {os.getpid()}).")
+
+    def submit(self, uploads, as_paths=False, **payload):
+        """Queue a job for a list of (filename, bytes or file object) uploads; raises QueueFull at capacity.
+
+        The handler gets (filename, bytes) pairs, or (filename, path) pairs
+        with as_paths, e.g. for videos too large to hold in memory.
+        """
+        conn = self._connect()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        job_folder = os.path.join(self.jobs_folder, job_id)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs already pending")
+
+            os.makedirs(job_folder)
+            filenames = []
+            for i, (filename, data) in enumerate(uploads):
+                # Prefix with the index so duplicate upload names do not collide
+                stored = f"{i}_{os.path.basename(filename)}"
+                with open(os.path.join(job_folder, stored), "wb") as f:
+                    if isinstance(data, bytes):
+                        f.write(data)
+                    else:
+                        shutil.copyfileobj(data, f)
+                filenames.append(stored)
+
+            payload["files"] = filenames
+            if as_paths:
+                payload["as_paths"] = True
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(payload), now, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            shutil.rmtree(job_folder, ignore_errors=True)
+            raise
+
+        self.start()
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def _claim(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running' AND updated_at < ?",
+                (now, now - JOB_STALE_SECONDS),
+            )
+            row = conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+        shutil.rmtree(os.path.join(self.jobs_folder, job_id), ignore_errors=True)
+
+    def _heartbeat(self, job_id, stop):
+        """Touch a running job until stop is set, so a slow job is not mistaken for a dead one."""
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                self._connect().execute(
+                    "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+            except sqlite3.Error as e:
+                print(f"[Warning] Job {job_id} heartbeat failed: {e}")
+
+    def run_next(self):
+        """Claim and run one queued job. Returns False when the queue is empty."""
+        row = self._claim()
+        if row is None:
+            return False
+
+        job_id = row["id"]
+        payload = json.loads(row["payload"])
+        job_folder = os.path.join(self.jobs_folder, job_id)
+        print(f"[Info] Running job {job_id}")
+
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, stop), name=f"job-heartbeat-{job_id[:8]}", daemon=True).start()
+        try:
+            uploads = []
+            as_paths = payload.pop("as_paths", False)
+            for filename in payload.pop("files"):
+                path = os.path.join(job_folder, filename)
+                if as_paths:
+                    uploads.append((filename.split("_", 1)[1], path))
+                    continue
+                with open(path, "rb") as f:
+                    uploads.append((filename.split("_", 1)[1], f.read()))
+            with IN_FLIGHT.track_inprogress(kind="job"):
+                result = self.handler(uploads, **payload)
+        except Exception as e:
+            print(f"[Error] Job {job_id} failed: {e}")
+            self._finish(job_id, "failed", error=str(e))
+        else:
+            self._finish(job_id, "done", result=result)
+        finally:
+            stop.set()
+        return True
+
+    def _worker_loop(self):
+        while True:
+            try:
+                if not self.run_next():
+                    time.sleep(POLL_INTERVAL)
+            except Exception as e:
+                print(f"[Error] Job worker: {e}")
+                time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    # Standalone worker process; run the web workers with JOB_WORKERS=0 to
+    # keep recognition out of the HTTP processes entirely
+    from api.app import job_queue
+
+    job_queue.start()
+    while True:
+        time.sleep(60)
@@ -0,0 +1,239 @@
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from metrics.telemetry import span
+
+# Persistent outbox for attendance emails. Messages are written to SQLite in
+# the request path and delivered by background sender threads, each of which
+# claims a batch and sends it over a single authenticated SMTP connection.
+# Undelivered messages survive restarts and transient failures are retried.
+#
+# To test locally, run a debugging server such as
+#   python -m aiosmtpd -n -l localhost:1025
+# and start the app with SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0.
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", "outbox.db")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_SENDERS = int(os.getenv("SMTP_SENDERS", "2"))
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("SMTP_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = 30
+# A batch claimed by a sender that died is handed out again after this long
+CLAIM_TIMEOUT = 600
+POLL_INTERVAL = 1.0
+
+def is_transient(error):
+    """4xx replies and connection problems are worth retrying; 5xx replies are not."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Socket-level failures: refused connections, timeouts, resets
+    return isinstance(error, OSError)
+
+
+def close_quietly(server):
+    if server is not None:
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+
+class Outbox:
+    def __init__(self, db_path=OUTBOX_DB, host=SMTP_HOST, port=SMTP_PORT, starttls=SMTP_STARTTLS,
+                 username=None, password=None, senders=SMTP_SENDERS, batch_size=SMTP_BATCH_SIZE,
+                 max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.senders = senders
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started_pid = None
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                message TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, messages):
+        """Persist (sender, recipient, message_string) tuples and wake the senders."""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO outbox (sender, recipient, message, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(sender, recipient, message, now, now) for sender, recipient, message in messages],
+        )
+        conn.execute("COMMIT")
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """Start the sender threads in this process (once per process, so it is fork-safe)."""
+        with self._lock:
+            if self._started_pid == os.getpid() or self.senders <= 0:
+                return
+            self._started_pid = os.getpid()
+            for i in range(self.senders):
+                threading.Thread(target=self._sender_loop, name=f"smtp-sender-{i}", daemon=True).start()
+
+    def _claim_batch(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                (now - CLAIM_TIMEOUT,),
+            )
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _open_connection(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def _mark_sent(self, row):
+        self._connect().execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL WHERE id = ?",
+            (time.time(), row["id"]),
+        )
+        print(f"📧 Email sent to {row['recipient']}")
+
+    def _mark_failed(self, row, error):
+        attempts = row["attempts"] + 1
+        if is_transient(error) and attempts < self.max_attempts:
+            status, next_attempt_at = 'pending', time.time() + RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        else:
+            status, next_attempt_at = 'failed', row["next_attempt_at"]
+        self._connect().execute(
+            "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (status, attempts, next_attempt_at, str(error), row["id"]),
+        )
+        print(f"[Error] Failed to send email to {row['recipient']} (attempt {attempts}, {status}): {error}")
+
+    def send_batch(self, rows):
+        """Send claimed rows over one connection, reconnecting if it drops."""
+        server = None
+        try:
+            for index, row in enumerate(rows):
+                for attempt in range(2):
+                    try:
+                        if server is None:
+                            server = self._open_connection()
+                    except Exception as e:
+                        # Could not connect or log in; retry the rest of the batch later
+                        for pending in rows[index:]:
+                            self._mark_failed(pending, e)
+                        return
+
+                    try:
+                        server.sendmail(row["sender"], [row["recipient"]], row["message"])
+                    except Exception as e:
+                        lost = isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException)
+                        if lost:
+                            close_quietly(server)
+                            server = None
+                            if attempt == 0:
+                                continue
+                        self._mark_failed(row, e)
+                    else:
+                        self._mark_sent(row)
+                    break
+        finally:
+            close_quietly(server)
+
+    def drain(self):
+        """Send everything that is currently due; returns the number of messages attempted."""
+        attempted = 0
+        while True:
+            rows = self._claim_batch()
+            if not rows:
+                return attempted
+            with span("email_send"):
+                self.send_batch(rows)
+            attempted += len(rows)
+
+    def _sender_loop(self):
+        while True:
+            try:
+                if not self.drain():
+                    self._wakeup.wait(POLL_INTERVAL)
+                    self._wakeup.clear()
+            except Exception as e:
+                print(f"[Error] SMTP sender: {e}")
+                time.sleep(POLL_INTERVAL)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Process-wide outbox using the sender credentials from the environment."""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(username=os.getenv("Email"), password=os.getenv("Password"))
+    return _outbox
+
+
+if __name__ == "__main__":
+    # Deliver anything left in the outbox, e.g. after a restart
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    print(f"[Info] Attempted {get_outbox().drain()} queued emails.")
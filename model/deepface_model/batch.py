@@ -0,0 +1,418 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import uuid
+from PIL import Image
+from deepface_model.embedding import MODEL_NAME, init_enrollment_worker
+from deepface_model.gallery import GALLERY_DIR, get_gallery
+from deepface_model.main import recognize_faces_in_uploads
+from deepface_model.parallel import ENROLL_WORKERS, iter_pool
+from deepface_model.roster import ROSTER_CSV, get_roster
+
+# Offline recognition over a tree of class photos, e.g. a semester backlog:
+#
+#   python -m deepface_model.batch photos/ --out results/ --workers 8
+#
+# Progress is checkpointed in <out>/checkpoint.db, so rerunning the same
+# command after a crash or Ctrl-C picks up where it stopped; images that
+# changed on disk since they were processed are done again. Recognized
+# students are streamed to <out>/<folder>/<date>/part-NNNNNN.csv (or .parquet)
+# files. A part file is only recorded in the checkpoint once it is complete,
+# and unrecorded leftovers are deleted on start, so every row lands exactly once.
+# When a changed image is redone, the part files holding its old rows are
+# rewritten without them, so the output only has rows from each image's
+# latest version.
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+RESULT_COLUMNS = ("image", "folder", "date", "name", "uin")
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+EXIF_IFD = 0x8769
+
+
+def find_images(root):
+    """Relative paths of every image under root, in a stable order."""
+    paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, filename), root))
+    return paths
+
+
+def photo_date(path):
+    """The day a photo was taken, from EXIF when present, else from its mtime."""
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            taken = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if taken:
+            return datetime.datetime.strptime(str(taken).strip()[:10], "%Y:%m:%d").date().isoformat()
+    except (OSError, ValueError):
+        pass
+    return datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+
+def init_batch_worker(model_name, threads, encoding_file, csv_path):
+    """Pool initializer: build the model and load the gallery and roster once per worker."""
+    init_enrollment_worker(model_name, threads)
+    get_gallery(encoding_file).refresh()
+    get_roster(csv_path)
+
+
+def recognize_image_file(task):
+    """Recognize one photo; task is (root, relative path, options). Runs in the pool workers."""
+    root, relpath, options = task
+    path = os.path.join(root, relpath)
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    stats = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if options["verbose"] else devnull):
+        # Backlog photos are seen once, so they are not worth a result cache entry
+        recognized = recognize_faces_in_uploads(
+            [(os.path.basename(relpath), data)],
+            grid_sizes=options["grid_sizes"],
+            encoding_file=options["encoding_file"],
+            csv_path=options["csv_path"],
+            threshold=options["threshold"],
+            stats=stats,
+            result_cache=False,
+            subject=options["subject"],
+        )
+
+    # Nothing decoded, or detection/embedding failed: record an error so --retry-failed picks it up
+    if not stats.get("tiles"):
+        raise ValueError("image could not be processed (undecodable, or recognition failed)")
+    if stats.get("tiles_failed"):
+        raise ValueError(f"detection failed on {stats['tiles_failed']} of {stats['tiles']} tiles")
+
+    return {
+        "date": photo_date(path),
+        "faces": stats.get("unique_faces", 0),
+        "students": [(face["name"], face.get("uin")) for face in recognized],
+        "seconds": time.perf_counter() - started,
+    }
+
+
+class Checkpoint:
+    """Per-image progress, pending result rows, and committed part files in SQLite."""
+
+    def __init__(self, out_dir):
+        self.conn = sqlite3.connect(os.path.join(out_dir, "checkpoint.db"), isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                faces INTEGER,
+                students INTEGER,
+                seconds REAL,
+                error TEXT,
+                processed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                date TEXT NOT NULL,
+                name TEXT NOT NULL,
+                uin TEXT,
+                part INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_part ON results (part);
+            CREATE TABLE IF NOT EXISTS parts (
+                seq INTEGER PRIMARY KEY,
+                file TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            -- Committed parts that still hold rows of an image that was redone
+            CREATE TABLE IF NOT EXISTS stale_parts (
+                seq INTEGER PRIMARY KEY
+            );
+        """)
+
+    def finished(self, retry_failed=False):
+        """{path: (size, mtime_ns)} of images that need no more work."""
+        statuses = ("done",) if retry_failed else ("done", "error")
+        rows = self.conn.execute(
+            f"SELECT path, size, mtime_ns FROM images WHERE status IN ({','.join('?' * len(statuses))})", statuses)
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def record(self, relpath, size, mtime_ns, result=None, error=None):
+        """Mark an image done (with its result rows) or failed, in one transaction."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A changed image is redone; its old rows are replaced, and the part
+            # files they were written to are rewritten at the next flush
+            self.conn.execute(
+                "INSERT OR IGNORE INTO stale_parts (seq) SELECT DISTINCT part FROM results WHERE image = ? AND part IS NOT NULL",
+                (relpath,))
+            self.conn.execute("DELETE FROM results WHERE image = ?", (relpath,))
+            if error is None:
+                folder = os.path.dirname(relpath) or "."
+                self.conn.executemany(
+                    "INSERT INTO results (image, folder, date, name, uin) VALUES (?, ?, ?, ?, ?)",
+                    [(relpath, folder, result["date"], name, uin) for name, uin in result["students"]],
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (path, size, mtime_ns, status, faces, students, seconds, error, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (relpath, size, mtime_ns, "error" if error else "done",
+                 result and result["faces"], result and len(result["students"]), result and result["seconds"], error, now),
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def pending_rows(self):
+        return self.conn.execute(
+            f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results WHERE part IS NULL ORDER BY folder, date, id").fetchall()
+
+    def next_part(self):
+        return (self.conn.execute("SELECT MAX(seq) FROM parts").fetchone()[0] or 0) + 1
+
+    def commit_part(self, seq, file, ids):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("INSERT INTO parts (seq, file, rows, created_at) VALUES (?, ?, ?, ?)",
+                              (seq, file, len(ids), time.time()))
+            self.conn.executemany("UPDATE results SET part = ? WHERE id = ?", [(seq, row_id) for row_id in ids])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def stale_parts(self):
+        return self.conn.execute(
+            "SELECT parts.seq, parts.file FROM stale_parts JOIN parts ON parts.seq = stale_parts.seq ORDER BY parts.seq").fetchall()
+
+    def part_rows(self, seq):
+        return self.conn.execute(
+            f"SELECT id, {', '.join(RESULT_COLUMNS)} FROM results WHERE part = ? ORDER BY id", (seq,)).fetchall()
+
+    def replace_part(self, old_seq, seq=None, file=None, rows=0):
+        """Swap a stale part for its rewritten copy (or drop it when seq is None), in one transaction."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if seq is not None:
+                self.conn.execute("INSERT INTO parts (seq, file, rows, created_at) VALUES (?, ?, ?, ?)",
+                                  (seq, file, rows, time.time()))
+                self.conn.execute("UPDATE results SET part = ? WHERE part = ?", (seq, old_seq))
+            self.conn.execute("DELETE FROM parts WHERE seq = ?", (old_seq,))
+            self.conn.execute("DELETE FROM stale_parts WHERE seq = ?", (old_seq,))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def committed_files(self):
+        return {file for (file,) in self.conn.execute("SELECT file FROM parts")}
+
+
+def write_part(path, rows, file_format):
+    """Write rows to path atomically, via a temporary file in the same directory."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    if file_format == "parquet":
+        import pandas as pd
+
+        pd.DataFrame(rows, columns=RESULT_COLUMNS).to_parquet(tmp, index=False)
+    else:
+        import csv
+
+        with open(tmp, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_COLUMNS)
+            writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def part_file(folder, date, seq, file_format):
+    return os.path.normpath(os.path.join(folder, date, f"part-{seq:06d}.{file_format}"))
+
+
+def compact_parts(checkpoint, out_dir, file_format):
+    """Rewrite the part files that hold rows of redone images with only their current rows.
+
+    The rewritten part is committed before the old file is deleted; if the run
+    stops in between, the old file is an orphan and is removed on the next start.
+    """
+    compacted = 0
+    for old_seq, old_file in checkpoint.stale_parts():
+        rows = checkpoint.part_rows(old_seq)
+        if rows:
+            seq = checkpoint.next_part()
+            file = part_file(rows[0][2], rows[0][3], seq, file_format)
+            write_part(os.path.join(out_dir, file), [row[1:] for row in rows], file_format)
+            checkpoint.replace_part(old_seq, seq, file, len(rows))
+        else:
+            checkpoint.replace_part(old_seq)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(out_dir, old_file))
+        compacted += 1
+    return compacted
+
+
+def flush_results(checkpoint, out_dir, file_format):
+    """Write every pending result row to one new part file per (folder, date) partition.
+
+    Part files with superseded rows are rewritten first. Returns the number of new rows written.
+    """
+    compact_parts(checkpoint, out_dir, file_format)
+
+    partitions = {}
+    for row in checkpoint.pending_rows():
+        partitions.setdefault((row[2], row[3]), []).append(row)
+
+    written = 0
+    for (folder, date), rows in partitions.items():
+        seq = checkpoint.next_part()
+        file = part_file(folder, date, seq, file_format)
+        write_part(os.path.join(out_dir, file), [row[1:] for row in rows], file_format)
+        checkpoint.commit_part(seq, file, [row[0] for row in rows])
+        written += len(rows)
+    return written
+
+
+def remove_orphan_parts(checkpoint, out_dir):
+    """Delete part files a crashed run wrote but never recorded; their rows are still pending."""
+    committed = checkpoint.committed_files()
+    removed = 0
+    for directory, _, filenames in os.walk(out_dir):
+        for filename in filenames:
+            if filename.startswith("part-"):
+                file = os.path.relpath(os.path.join(directory, filename), out_dir)
+                if file not in committed:
+                    os.remove(os.path.join(out_dir, file))
+                    removed += 1
+    return removed
+
+
+def summarize(counts, latencies, elapsed):
+    summary = dict(counts)
+    summary["elapsed_s"] = round(elapsed, 2)
+    summary["images_per_s"] = round(counts["processed"] / elapsed, 3) if elapsed else 0.0
+    if latencies:
+        ordered = sorted(latencies)
+        summary["image_seconds"] = {
+            "mean": round(statistics.mean(ordered), 3),
+            "p50": round(ordered[len(ordered) // 2], 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize students in a directory tree of class photos, resumably")
+    parser.add_argument("root", help="directory to walk for images")
+    parser.add_argument("--out", default="batch_results", help="output directory (also holds the checkpoint)")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--workers", type=int, default=ENROLL_WORKERS)
+    parser.add_argument("--threads", type=int, default=1, help="TensorFlow threads per worker")
+    parser.add_argument("--flush-every", type=int, default=200, help="write part files every N images")
+    parser.add_argument("--encoding-file", default=GALLERY_DIR)
+    parser.add_argument("--csv", dest="csv_path", default=ROSTER_CSV, help="roster CSV")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--subject", help="match against this subject's cohort only")
+    parser.add_argument("--retry-failed", action="store_true", help="process images that failed before again")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's per-tile logs")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+    if not os.path.isdir(args.root):
+        parser.error(f"'{args.root}' is not a directory")
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint = Checkpoint(args.out)
+    removed = remove_orphan_parts(checkpoint, args.out)
+    if removed:
+        print(f"[Info] Removed {removed} incomplete part files from an interrupted run")
+    counts = {"images": 0, "skipped": 0, "processed": 0, "failed": 0, "faces": 0, "rows": 0}
+    # Rows recorded before an interrupted flush are written out first
+    counts["rows"] += flush_results(checkpoint, args.out, args.format)
+
+    finished = checkpoint.finished(args.retry_failed)
+    todo = []
+    for relpath in find_images(args.root):
+        counts["images"] += 1
+        stat = os.stat(os.path.join(args.root, relpath))
+        if finished.get(relpath) == (stat.st_size, stat.st_mtime_ns):
+            counts["skipped"] += 1
+        else:
+            todo.append((relpath, stat.st_size, stat.st_mtime_ns))
+    print(f"[Info] {counts['images']} images under '{args.root}': {counts['skipped']} already done, {len(todo)} to process")
+
+    options = {
+        "grid_sizes": (3, 4),
+        "encoding_file": args.encoding_file,
+        "csv_path": args.csv_path,
+        "threshold": args.threshold,
+        "subject": args.subject,
+        "verbose": args.verbose,
+    }
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    started = time.perf_counter()
+    step = max(1, len(todo) // 100)
+    interrupted = False
+
+    tasks = ((args.root, relpath, options) for relpath, _, _ in todo)
+    try:
+        for done, (i, result, error) in enumerate(iter_pool(
+                recognize_image_file, tasks, min(args.workers, len(todo)) if todo else 1,
+                initializer=init_batch_worker,
+                initargs=(MODEL_NAME, args.threads, args.encoding_file, args.csv_path)), start=1):
+            relpath, size, mtime_ns = todo[i]
+            checkpoint.record(relpath, size, mtime_ns, result, error)
+            if error:
+                counts["failed"] += 1
+                print(f"[Error] {relpath}: {error}")
+            else:
+                counts["processed"] += 1
+                counts["faces"] += result["faces"]
+                latencies.append(result["seconds"])
+
+            if done % args.flush_every == 0:
+                counts["rows"] += flush_results(checkpoint, args.out, args.format)
+            if done == len(todo) or done % step == 0:
+                elapsed = time.perf_counter() - started
+                print(f"[Progress] {done}/{len(todo)} images, {counts['processed'] / elapsed:.2f} images/s")
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\n[Info] Interrupted; progress is saved, rerun the same command to resume")
+
+    counts["rows"] += flush_results(checkpoint, args.out, args.format)
+    summary = summarize(counts, latencies, time.perf_counter() - started)
+    summary.update(run_id=run_id, workers=args.workers, interrupted=interrupted)
+    with open(os.path.join(args.out, f"summary-{run_id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"\n[Info] {summary['processed']} processed, {summary['failed']} failed, {summary['skipped']} skipped "
+          f"in {summary['elapsed_s']}s ({summary['images_per_s']} images/s); "
+          f"{summary['faces']} faces, {summary['rows']} attendance rows")
+    if "image_seconds" in summary:
+        print(f"[Info] Seconds per image: mean {summary['image_seconds']['mean']}, "
+              f"p50 {summary['image_seconds']['p50']}, p95 {summary['image_seconds']['p95']}")
+    return 130 if interrupted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# Tiles from the 3x3 and 4x4 grids overlap, so one physical face is usually
+# detected several times. Detections are mapped back to source-image
+# coordinates and merged here so that each face is embedded only once.
+
+IOU_THRESHOLD = 0.4
+# A face cut by a tile edge is mostly contained in the uncut detection from
+# the other grid, which IoU alone does not catch
+OVERLAP_THRESHOLD = 0.7
+EDGE_MARGIN = 2
+
+
+def box_overlap(a, b):
+    """Return (IoU, intersection over the smaller box) for two (x, y, w, h) boxes."""
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    if inter == 0:
+        return 0.0, 0.0
+    area_a, area_b = a[2] * a[3], b[2] * b[3]
+    return inter / (area_a + area_b - inter), inter / min(area_a, area_b)
+
+
+def make_detection(tile, face):
+    """Describe an extract_faces result in the coordinates of the tile's original source image."""
+    area = face['facial_area']
+    x, y, w, h = area['x'], area['y'], area['w'], area['h']
+    tile_x, tile_y, tile_w, tile_h = tile.get("box") or (0, 0, tile["image"].shape[1], tile["image"].shape[0])
+
+    scale = tile.get("scale") or 1.0
+
+    # With enforce_detection=False a tile without faces comes back whole
+    fallback = x == 0 and y == 0 and w >= tile_w and h >= tile_h
+
+    # A box touching a tile edge that is not also an image edge is likely cut
+    cut = False
+    if "image_size" in tile and not fallback:
+        width, height = tile["image_size"]
+        cut = (
+            (x <= EDGE_MARGIN and tile_x > 0)
+            or (y <= EDGE_MARGIN and tile_y > 0)
+            or (x + w >= tile_w - EDGE_MARGIN and tile_x + 2 * tile_w <= width)
+            or (y + h >= tile_h - EDGE_MARGIN and tile_y + 2 * tile_h <= height)
+        )
+
+    return {
+        "tile": tile["name"],
+        "source": tile.get("source", tile["name"]),
+        "box": tuple(int(round(v / scale)) for v in (tile_x + x, tile_y + y, w, h)),
+        "confidence": face.get('confidence') or 0,
+        "cut": cut,
+        "fallback": fallback,
+        "face": face['face'],
+    }
+
+
+def deduplicate_faces(detections, iou_threshold=IOU_THRESHOLD, overlap_threshold=OVERLAP_THRESHOLD):
+    """Merge detections of the same face within each source image.
+
+    Uncut boxes win over cut ones, then higher confidence, then larger area.
+    Whole-tile fallbacks are not real detections and are never merged.
+    Returns the kept detections in their original order.
+    """
+    order = sorted(
+        range(len(detections)),
+        key=lambda i: (
+            detections[i]["cut"],
+            -detections[i]["confidence"],
+            -detections[i]["box"][2] * detections[i]["box"][3],
+            i,
+        ),
+    )
+
+    kept = []
+    kept_by_source = {}
+    for i in order:
+        detection = detections[i]
+        if not detection["fallback"]:
+            others = kept_by_source.setdefault(detection["source"], [])
+            if any(
+                iou >= iou_threshold or overlap >= overlap_threshold
+                for iou, overlap in (box_overlap(detection["box"], other["box"]) for other in others)
+            ):
+                continue
+            others.append(detection)
+        kept.append(i)
+
+    return [detections[i] for i in sorted(kept)]
@@ -0,0 +1,79 @@
+import os
+import threading
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import preprocessing
+
+MODEL_NAME = 'Facenet'
+DETECTOR_BACKEND = 'opencv'
+# Faces per Facenet forward pass; larger batches amortize per-call overhead on CPU
+BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# DeepFace caches one detector per backend for the whole process; for "opencv"
+# that is a CascadeClassifier, which is not thread-safe, and gunicorn runs
+# several request threads per worker. Detection is serialized per backend;
+# embedding still overlaps across threads through scheduler.py.
+_detector_locks = {}
+_detector_locks_lock = threading.Lock()
+
+
+def _detector_lock(detector_backend):
+    with _detector_locks_lock:
+        return _detector_locks.setdefault(detector_backend, threading.Lock())
+
+
+def detect_faces(image, detector_backend=DETECTOR_BACKEND):
+    """Detect and align faces in a BGR array, exactly as DeepFace.represent does.
+
+    With enforce_detection=False a tile without a face yields the whole tile
+    as a single face (confidence 0), matching the previous per-tile results.
+    """
+    with _detector_lock(detector_backend):
+        return DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=detector_backend,
+            enforce_detection=False,
+            align=True,
+        )
+
+
+def prepare_face(face, target_size):
+    """Turn an extract_faces crop into a model input of shape (1, h, w, 3)."""
+    # extract_faces returns RGB; represent flips it back to BGR before resizing
+    img = face[:, :, ::-1]
+    img = preprocessing.resize_image(img=img, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization="base")
+
+
+def embed_faces(faces, model_name=MODEL_NAME, batch_size=BATCH_SIZE):
+    """Embed face crops in batched forward passes; returns a (len(faces), dim) float32 array."""
+    model = DeepFace.build_model(model_name)
+    target_size = model.input_shape
+
+    embeddings = []
+    for start in range(0, len(faces), batch_size):
+        batch = np.concatenate([prepare_face(face, target_size) for face in faces[start:start + batch_size]])
+        embeddings.append(model.model(batch, training=False).numpy().astype(np.float32))
+
+    if not embeddings:
+        return np.zeros((0, model.output_shape), dtype=np.float32)
+    return np.concatenate(embeddings)
+
+
+def init_enrollment_worker(model_name=MODEL_NAME, threads=1):
+    """Pool initializer: keep each worker to a few threads and build the model once."""
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    except (ImportError, RuntimeError):
+        pass
+    DeepFace.build_model(model_name)
+
+
+def embed_image_file(task):
+    """Embed an enrollment image the way train_faces always has; task is (path, model_name)."""
+    image_path, model_name = task
+    result = DeepFace.represent(image_path, model_name=model_name, enforce_detection=False)
+    return np.asarray(result[0]['embedding'], dtype=np.float32)
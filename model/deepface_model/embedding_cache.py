@@ -0,0 +1,106 @@
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Per-image embeddings for training, keyed by image content hash and model
+# name, so retraining only embeds images that are new or have changed.
+
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "embedding_cache.db")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, db_path=EMBEDDING_CACHE):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                content_hash TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, model_name)
+            )
+        """)
+        # Remembers each file's hash by size and mtime so unchanged files are not re-read
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT content_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        content_hash = file_hash(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, content_hash),
+        )
+        return content_hash
+
+    def get_many(self, content_hashes, model_name):
+        """Return {content_hash: embedding} for the hashes already cached for this model."""
+        found = {}
+        hashes = list(set(content_hashes))
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT content_hash, embedding FROM embeddings WHERE model_name = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                [model_name, *chunk],
+            )
+            for content_hash, blob in rows:
+                found[content_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put(self, content_hash, model_name, path, embedding):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO embeddings (content_hash, model_name, path, embedding, created_at) VALUES (?, ?, ?, ?, ?)",
+            (content_hash, model_name, path, np.asarray(embedding, dtype=np.float32).tobytes(), time.time()),
+        )
+
+    def prune(self, model_name, keep_hashes, keep_paths):
+        """Delete embeddings and file hashes that no longer belong to the dataset. Returns the count removed."""
+        keep_hashes = set(keep_hashes)
+        keep_paths = set(keep_paths)
+        stale = [
+            content_hash
+            for (content_hash,) in self.conn.execute("SELECT content_hash FROM embeddings WHERE model_name = ?", (model_name,))
+            if content_hash not in keep_hashes
+        ]
+        self.conn.executemany(
+            "DELETE FROM embeddings WHERE model_name = ? AND content_hash = ?",
+            [(model_name, content_hash) for content_hash in stale],
+        )
+        self.conn.executemany(
+            "DELETE FROM file_hashes WHERE path = ?",
+            [(path,) for (path,) in self.conn.execute("SELECT path FROM file_hashes").fetchall() if path not in keep_paths],
+        )
+        return len(stale)
+
+    def commit(self):
+        self.conn.commit()
@@ -0,0 +1,220 @@
+import os
+import threading
+import numpy as np
+from deepface_model.dedup import deduplicate_faces, make_detection
+from deepface_model.embedding import detect_faces
+from deepface_model.gallery import GALLERY_DIR, get_gallery
+from deepface_model.main import assemble_recognized_faces, match_cohort, recognize_faces_in_tiles, recognize_faces_in_uploads
+from deepface_model.roster import ROSTER_CSV, get_roster
+from deepface_model.scheduler import embed_faces_shared
+from metrics.division import decode_image, tile_image
+from metrics.telemetry import span
+from recognition.face_cache import CACHE_DIR
+
+# The two recognition backends behind one interface: load the gallery, detect
+# faces in a tile, embed a batch of detections, and match embeddings against
+# the gallery. "deepface" is Facenet with cosine similarity (main.py);
+# "dlib" is face_recognition with Euclidean distance (recognition/training.py,
+# enrolled from the same ROSTER_CSV as the DeepFace gallery).
+# Both galleries use the shared on-disk format, and scores are always
+# similarities, so thresholds, subject cohorts, and the roster work the same.
+# RECOGNITION_ENGINE picks the backend the API uses;
+# `python -m metrics.compare_engines` compares their latency and results.
+
+RECOGNITION_ENGINE = os.getenv("RECOGNITION_ENGINE", "deepface")
+# Where recognition/face_cache.py saves the face_recognition encodings
+DLIB_GALLERY_DIR = os.getenv("DLIB_GALLERY_DIR", CACHE_DIR)
+# "hog" runs on the CPU; "cnn" is more accurate but needs a GPU to be usable
+DLIB_DETECTION_MODEL = os.getenv("DLIB_DETECTION_MODEL", "hog")
+# Context kept around each dlib crop, as a fraction of the face size, for the landmark model
+DLIB_CROP_MARGIN = 0.25
+
+
+class RecognitionEngine:
+    """A recognition backend; subclasses provide detect() and embed().
+
+    Scores are similarities (higher is better) compared against the engine's
+    own threshold, since the backends' score scales differ.
+    """
+
+    name = None
+    threshold = None
+
+    def __init__(self, encoding_file):
+        self.encoding_file = encoding_file
+
+    def load_gallery(self):
+        """The engine's gallery, reloaded if it changed on disk; None when it is missing."""
+        gallery = get_gallery(self.encoding_file)
+        if not gallery.refresh():
+            print(f"[Error] Encoding file '{self.encoding_file}' not found.")
+            return None
+        return gallery
+
+    def detect(self, tile):
+        """Detections (see dedup.make_detection) in one tile."""
+        raise NotImplementedError
+
+    def embed(self, detections):
+        """A (len(detections), dim) float32 array of embeddings."""
+        raise NotImplementedError
+
+    def match(self, embeddings, gallery, roster, threshold=None, subject=None, stats=None):
+        """Best gallery match for every embedding; returns (names, scores)."""
+        threshold = self.threshold if threshold is None else threshold
+        with span("matching"):
+            return match_cohort(embeddings, gallery, roster, threshold, subject, stats=stats)
+
+    def recognize_tiles(self, tiles, csv_path=ROSTER_CSV, threshold=None, stats=None, subject=None):
+        """Recognize faces in in-memory tiles, like main.recognize_faces_in_tiles."""
+        gallery = self.load_gallery()
+        if gallery is None:
+            return []
+        roster = get_roster(csv_path)
+        threshold = self.threshold if threshold is None else threshold
+
+        detections = []
+        with span("detection"):
+            for tile in tiles:
+                try:
+                    detections.extend(self.detect(tile))
+                except Exception as e:
+                    print(f"[Error] Failed to process {tile['name']}: {e}")
+
+        unique = deduplicate_faces(detections)
+        try:
+            with span("embedding"):
+                embeddings = self.embed(unique)
+        except Exception as e:
+            print(f"[Error] Failed to embed faces: {e}")
+            return []
+        names, scores = self.match(embeddings, gallery, roster, threshold, subject, stats)
+
+        if stats is not None:
+            stats.update({
+                "engine": self.name,
+                "tiles": len(tiles),
+                "detections": len(detections),
+                "unique_faces": len(unique),
+                "embeddings_avoided": len(detections) - len(unique),
+            })
+        return assemble_recognized_faces(names, scores, roster, threshold)
+
+    def recognize_uploads(self, uploads, grid_sizes=(3, 4), csv_path=ROSTER_CSV, threshold=None, stats=None, subject=None):
+        """Recognize faces in a list of (filename, encoded image bytes) uploads."""
+        tiles = []
+        image_names = set()
+        for filename, data in uploads:
+            with span("decode"):
+                image, scale = decode_image(data, grid_sizes)
+            if image is None:
+                print(f"[ERROR] Could not load image: {filename}")
+                continue
+
+            # Tiles are grouped by source name for dedup, so names must be unique
+            image_name = os.path.splitext(os.path.basename(filename))[0]
+            if image_name in image_names:
+                image_name = f"{image_name}_{len(image_names)}"
+            image_names.add(image_name)
+
+            with span("split_image"):
+                tiles.extend(tile_image(image, image_name, grid_sizes, scale))
+
+        return self.recognize_tiles(tiles, csv_path, threshold, stats, subject)
+
+
+class DeepFaceEngine(RecognitionEngine):
+    """Facenet embeddings matched by cosine similarity.
+
+    Whole uploads go through main.py, which adds the tile pre-filter, face
+    enhancement, and the result cache around the same detect/embed/match steps.
+    result_cache=False turns the cache off, e.g. for timing.
+    """
+
+    name = "deepface"
+    threshold = 0.7
+
+    def __init__(self, encoding_file=GALLERY_DIR, result_cache=None):
+        super().__init__(encoding_file)
+        self.result_cache = result_cache
+
+    def detect(self, tile):
+        return [make_detection(tile, face) for face in detect_faces(tile["image"])]
+
+    def embed(self, detections):
+        return embed_faces_shared([detection["face"] for detection in detections])
+
+    def recognize_tiles(self, tiles, csv_path=ROSTER_CSV, threshold=None, stats=None, subject=None):
+        threshold = self.threshold if threshold is None else threshold
+        result = recognize_faces_in_tiles(tiles, self.encoding_file, csv_path, threshold, stats=stats, subject=subject)
+        if stats is not None:
+            stats["engine"] = self.name
+        return result
+
+    def recognize_uploads(self, uploads, grid_sizes=(3, 4), csv_path=ROSTER_CSV, threshold=None, stats=None, subject=None):
+        threshold = self.threshold if threshold is None else threshold
+        result = recognize_faces_in_uploads(uploads, grid_sizes, self.encoding_file, csv_path, threshold,
+                                            stats=stats, result_cache=self.result_cache, subject=subject)
+        if stats is not None:
+            stats["engine"] = self.name
+        return result
+
+
+class DlibEngine(RecognitionEngine):
+    """face_recognition (dlib) encodings matched by Euclidean distance.
+
+    Scores are 1 - distance, so the 0.6 threshold is the 0.4 distance
+    recognition/training.py has always used. The gallery is the one
+    recognition/face_cache.py writes.
+    """
+
+    name = "dlib"
+    threshold = 0.6
+
+    def __init__(self, encoding_file=DLIB_GALLERY_DIR, model=DLIB_DETECTION_MODEL):
+        super().__init__(encoding_file)
+        self.model = model
+
+    def detect(self, tile):
+        import face_recognition
+
+        rgb = np.ascontiguousarray(tile["image"][:, :, ::-1])
+        height, width = rgb.shape[:2]
+        detections = []
+        for top, right, bottom, left in face_recognition.face_locations(rgb, model=self.model):
+            top, left, bottom, right = max(0, top), max(0, left), min(height, bottom), min(width, right)
+            margin = int(DLIB_CROP_MARGIN * max(bottom - top, right - left))
+            y0, x0 = max(0, top - margin), max(0, left - margin)
+            face = {
+                "facial_area": {"x": left, "y": top, "w": right - left, "h": bottom - top},
+                # dlib rejects non-contiguous arrays, and a slice of the tile is a strided view
+                "face": np.ascontiguousarray(rgb[y0:min(height, bottom + margin), x0:min(width, right + margin)]),
+            }
+            detection = make_detection(tile, face)
+            # face_encodings wants the box inside the crop as (top, right, bottom, left)
+            detection["location"] = (top - y0, right - x0, bottom - y0, left - x0)
+            detections.append(detection)
+        return detections
+
+    def embed(self, detections):
+        import face_recognition
+
+        encodings = [face_recognition.face_encodings(d["face"], [d["location"]])[0] for d in detections]
+        return np.asarray(encodings, dtype=np.float32).reshape(len(detections), 128)
+
+
+ENGINES = {"deepface": DeepFaceEngine, "dlib": DlibEngine}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name=RECOGNITION_ENGINE):
+    """Process-wide engine by name; RECOGNITION_ENGINE by default."""
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is None:
+            if name not in ENGINES:
+                raise ValueError(f"Unknown recognition engine '{name}' (expected one of: {', '.join(ENGINES)})")
+            engine = _engines[name] = ENGINES[name]()
+    return engine
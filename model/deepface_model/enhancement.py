@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# Optional enhancement of small face crops, from recognition/ehnanement.py:
+# bicubic upscaling followed by a sharpening filter. Only crops whose short side
+# is below ENHANCE_MIN_SIZE are touched, so back-row faces get help without
+# upscaling whole photos. For the pipeline the two steps are fused: each crop
+# is resized once, straight to the model's input size (the model would resize
+# it there anyway), and sharpened at that size. OpenCV releases the GIL, so the
+# crops are processed on a thread pool.
+
+ENHANCE_FACES = os.getenv("ENHANCE_FACES", "0") == "1"
+ENHANCE_MIN_SIZE = int(os.getenv("ENHANCE_MIN_SIZE", "80"))
+ENHANCE_THREADS = int(os.getenv("ENHANCE_THREADS", "4"))
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def enhance_array(image, scale=2.0, size=None, sharpen=True):
+    """Upscale an image with bicubic interpolation and sharpen it.
+
+    size=(width, height) resizes straight to that size instead of by scale.
+    Float images (e.g. extract_faces crops in [0, 1]) are clipped back to [0, 1].
+    """
+    if size is None:
+        size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    image = cv2.resize(image, size, interpolation=cv2.INTER_CUBIC)
+    if sharpen:
+        image = cv2.filter2D(image, -1, SHARPEN_KERNEL)
+    if image.dtype.kind == 'f':
+        np.clip(image, 0, 1, out=image)
+    return image
+
+
+def fit_size(shape, target_size):
+    """(width, height) that fits a crop of shape into target_size (height, width), keeping the aspect ratio."""
+    factor = min(target_size[0] / shape[0], target_size[1] / shape[1])
+    return (
+        min(target_size[1], max(1, round(shape[1] * factor))),
+        min(target_size[0], max(1, round(shape[0] * factor))),
+    )
+
+
+def _pool(threads):
+    """Per-process thread pool, recreated after a fork."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="enhance")
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def enhance_faces(detections, target_size, min_size=ENHANCE_MIN_SIZE, threads=ENHANCE_THREADS):
+    """Enhance the "face" of every detection smaller than min_size, in place; returns how many were enhanced.
+
+    target_size is the model input as (height, width). Whole-tile fallbacks are left alone.
+    """
+    small = [
+        detection for detection in detections
+        if not detection.get("fallback") and min(detection["face"].shape[:2]) < min_size
+    ]
+    if not small:
+        return 0
+
+    def enhance(detection):
+        detection["face"] = enhance_array(detection["face"], size=fit_size(detection["face"].shape, target_size))
+
+    if threads > 1 and len(small) > 1:
+        list(_pool(threads).map(enhance, small))
+    else:
+        for detection in small:
+            enhance(detection)
+    return len(small)
@@ -0,0 +1,163 @@
+import os
+import pickle
+import threading
+import numpy as np
+from deepface_model.gallery_store import gallery_mtime, open_gallery
+from deepface_model.index import FACE_INDEX, ExactIndex, build_index, load_index
+
+GALLERY_DIR = os.getenv("GALLERY_DIR", "gallery")
+
+
+def normalize_rows(vectors):
+    """L2-normalize each row as float32; all-zero rows stay zero."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def match_rows(names, index, embeddings):
+    """Best match for every embedding; returns (names, scores) with None / -1 when nothing was found.
+
+    Scores are similarities for either metric: Euclidean distances from an l2
+    index become 1 - distance, the "similarity" recognition/training.py reports.
+    """
+    count = len(embeddings)
+    if count == 0 or len(names) == 0:
+        return np.full(count, None, dtype=object), np.full(count, -1.0, dtype=np.float32)
+
+    best, scores = index.search(embeddings, k=1)
+    best, scores = best[:, 0], scores[:, 0]
+    found = best >= 0
+    if index.metric == "l2":
+        scores = 1.0 - scores
+    matched = np.full(count, None, dtype=object)
+    matched[found] = names[best[found]]
+    return matched, np.where(found, scores, -1.0).astype(np.float32)
+
+
+class GalleryPartition:
+    """A subset of a gallery's rows, such as the students enrolled in one subject."""
+
+    def __init__(self, names, index):
+        self.names = names
+        self.index = index
+
+    def __len__(self):
+        return len(self.names)
+
+    def match(self, embeddings):
+        return match_rows(self.names, self.index, embeddings)
+
+
+class FaceGallery:
+    """Enrolled embeddings as a normalized float32 matrix.
+
+    encoding_file is a gallery directory (see gallery_store.py), whose matrix
+    is memory-mapped and shared between workers, or a legacy face_encodings.pkl.
+    It is reloaded only when its mtime changes.
+    """
+
+    def __init__(self, encoding_file=GALLERY_DIR, index_kind=FACE_INDEX):
+        self.encoding_file = encoding_file
+        self.index_kind = index_kind
+        self.header = None
+        self._lock = threading.Lock()
+        self._mtime = None
+        # names and index are swapped together so readers never see a mix
+        self._data = (np.array([], dtype=object), ExactIndex(np.zeros((0, 0), dtype=np.float32), prepared=True))
+        # subject -> ((gallery mtime, roster version), partition or None)
+        self._cohorts = {}
+
+    def __len__(self):
+        return len(self._data[0])
+
+    @property
+    def names(self):
+        return self._data[0]
+
+    def _stat(self):
+        if os.path.isdir(self.encoding_file):
+            return gallery_mtime(self.encoding_file)
+        try:
+            return os.stat(self.encoding_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """Load the gallery if it changed since the last load. Returns False if it is missing."""
+        mtime = self._stat()
+        if mtime is None:
+            return False
+
+        if mtime == self._mtime:
+            return True
+
+        with self._lock:
+            if mtime == self._mtime:
+                return True
+
+            if os.path.isdir(self.encoding_file):
+                header, names, _, matrix = open_gallery(self.encoding_file)
+                names = np.array(names, dtype=object)
+                metric = header.get("metric", "cosine")
+                if metric == "cosine" and not header["normalized"]:
+                    matrix = normalize_rows(matrix)
+                index = load_index(header["version_dir"], matrix, metric, kind=self.index_kind)
+            else:
+                with open(self.encoding_file, 'rb') as f:
+                    face_encodings = pickle.load(f)
+                header = None
+                names = np.array(list(face_encodings.keys()), dtype=object)
+                matrix = normalize_rows([face_encodings[name] for name in names]) if len(names) else np.zeros((0, 0), dtype=np.float32)
+                index = ExactIndex(matrix, prepared=True)
+
+            self._data = (names, index)
+            self.header = header
+            self._mtime = mtime
+            print(f"[Info] Loaded {len(names)} encodings from '{self.encoding_file}' ({index.kind} index).")
+        return True
+
+    def match(self, embeddings):
+        """Best match for every embedding through the gallery's search index.
+
+        Returns (names, scores) arrays with one entry per embedding; scores are
+        similarities (see match_rows), names are None when nothing was found.
+        """
+        names, index = self._data
+        return match_rows(names, index, embeddings)
+
+    def cohort(self, subject, roster):
+        """Partition holding only the students the roster enrolls in subject.
+
+        Partitions are built on first use and cached until the gallery or the
+        roster changes. Returns None when the roster lists nobody for subject.
+        """
+        cached = self._cohorts.get(subject)
+        if cached is not None and cached[0] == (self._mtime, roster.version):
+            return cached[1]
+
+        # Under the load lock, so the rows and the version come from the same load
+        with self._lock:
+            names, index = self._data
+            version = (self._mtime, roster.version)
+            members = {student["name"] for student in roster.students_in(subject)}
+            partition = None
+            if members:
+                rows = np.flatnonzero([name in members for name in names])
+                partition = GalleryPartition(names[rows], build_index(index.vectors[rows], index.metric, self.index_kind, prepared=True))
+            self._cohorts[subject] = (version, partition)
+        return partition
+
+
+_galleries = {}
+_galleries_lock = threading.Lock()
+
+
+def get_gallery(encoding_file=GALLERY_DIR):
+    """Per-process gallery for an encoding file; call refresh() before matching."""
+    with _galleries_lock:
+        gallery = _galleries.get(encoding_file)
+        if gallery is None:
+            gallery = _galleries[encoding_file] = FaceGallery(encoding_file)
+    return gallery
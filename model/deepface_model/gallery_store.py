@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from deepface_model.index import build_index
+
+# On-disk gallery format shared by the DeepFace and face_recognition paths:
+#
+#   <gallery>/CURRENT               name of the live version directory
+#   <gallery>/<version>/header.json format version, model, dim, count, metric, dataset hash
+#   <gallery>/<version>/index.json  row names and optional per-row metadata
+#   <gallery>/<version>/embeddings.npy  float32 (count, dim) matrix
+#
+# The matrix is opened with mmap, so every worker on a host shares the same
+# physical pages. A new version is written to its own directory and made live
+# by atomically replacing CURRENT, so readers never see a half-written gallery.
+
+FORMAT_VERSION = 1
+KEEP_VERSIONS = 2
+
+
+def dataset_hash(items):
+    """Stable hash of an iterable of strings describing the training data."""
+    digest = hashlib.sha256()
+    for item in sorted(items):
+        digest.update(item.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def current_path(directory):
+    return os.path.join(directory, "CURRENT")
+
+
+def save_gallery(directory, names, vectors, model_name, metric="cosine", dataset_hash=None, metadata=None, index_kind=None):
+    """Write a new gallery version and make it live. Cosine galleries are stored L2-normalized.
+
+    With index_kind, a search index (see index.py) is built and saved with the version.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(len(names), -1) if len(names) else np.zeros((0, 0), dtype=np.float32)
+    if metric == "cosine" and len(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+    os.makedirs(directory, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+
+    np.save(os.path.join(version_dir, "embeddings.npy"), np.ascontiguousarray(vectors))
+    with open(os.path.join(version_dir, "index.json"), "w") as f:
+        json.dump({"names": list(names), "metadata": metadata}, f)
+    with open(os.path.join(version_dir, "header.json"), "w") as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "model": model_name,
+            "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            "count": len(names),
+            "metric": metric,
+            "normalized": metric == "cosine",
+            "dataset_hash": dataset_hash,
+            "index": index_kind,
+            "created_at": time.time(),
+        }, f, indent=2)
+
+    if index_kind:
+        build_index(vectors, metric, index_kind, prepared=True).save(version_dir)
+
+    tmp = current_path(directory) + f".tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, current_path(directory))
+
+    # Old versions can go; workers that still map them keep their pages until they reload
+    versions = sorted(name for name in os.listdir(directory) if name.startswith("v") and name != version)
+    for old in versions[:max(0, len(versions) - KEEP_VERSIONS + 1)]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    return version_dir
+
+
+def gallery_mtime(directory):
+    """mtime of the CURRENT pointer, or None if there is no gallery."""
+    try:
+        return os.stat(current_path(directory)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def open_gallery(directory, mmap=True):
+    """Return (header, names, metadata, matrix); the matrix is memory-mapped read-only."""
+    with open(current_path(directory)) as f:
+        version_dir = os.path.join(directory, f.read().strip())
+
+    with open(os.path.join(version_dir, "header.json")) as f:
+        header = json.load(f)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported gallery format {header.get('format_version')} in '{version_dir}'")
+
+    with open(os.path.join(version_dir, "index.json")) as f:
+        index = json.load(f)
+
+    matrix = np.load(os.path.join(version_dir, "embeddings.npy"), mmap_mode='r' if mmap else None)
+    if matrix.shape[0] != header["count"] or len(index["names"]) != header["count"]:
+        raise ValueError(f"Gallery '{version_dir}' is inconsistent with its header")
+
+    header["version_dir"] = version_dir
+    return header, index["names"], index.get("metadata"), matrix
+
+
+if __name__ == "__main__":
+    # python -m deepface_model.gallery_store <face_encodings.pkl> <gallery_dir> [model]
+    import pickle
+
+    pickle_path, directory = sys.argv[1], sys.argv[2]
+    model_name = sys.argv[3] if len(sys.argv) > 3 else "Facenet"
+    with open(pickle_path, 'rb') as f:
+        face_encodings = pickle.load(f)
+    names = list(face_encodings.keys())
+    save_gallery(directory, names, [face_encodings[name] for name in names], model_name)
+    print(f"[Info] Converted {len(names)} encodings from '{pickle_path}' to '{directory}'.")
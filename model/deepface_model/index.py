@@ -0,0 +1,287 @@
+import argparse
+import math
+import os
+import sys
+import time
+import numpy as np
+
+# Nearest-neighbour search over gallery embeddings. "exact" scans every row;
+# "ivf" is an inverted-file index: rows are clustered with k-means and a query
+# only scans the rows of its nprobe closest clusters. Choose per deployment
+# with FACE_INDEX.
+#
+# Scores are cosine similarities (higher is better) for metric="cosine" and
+# Euclidean distances (lower is better) for metric="l2".
+
+FACE_INDEX = os.getenv("FACE_INDEX", "exact")
+# Lists probed per query, as a fraction of nlist; with nlist = sqrt(n), 0.2
+# keeps recall@1 at or above IVF_RECALL_TARGET from 10k to 100k rows on the
+# synthetic benchmark below. FACE_INDEX_NPROBE pins a fixed count instead.
+IVF_NPROBE_FRACTION = float(os.getenv("FACE_INDEX_NPROBE_FRACTION", "0.2"))
+IVF_NPROBE = int(os.getenv("FACE_INDEX_NPROBE")) if os.getenv("FACE_INDEX_NPROBE") else None
+IVF_RECALL_TARGET = 0.95
+# Below this size an exact scan is as fast as IVF and always correct
+IVF_MIN_SIZE = 1000
+
+
+def _prepare(vectors, metric):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if metric == "cosine":
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+    return vectors
+
+
+def _scores(queries, vectors, metric):
+    """Score matrix (len(queries), len(vectors)) in the metric's convention."""
+    if metric == "cosine":
+        return queries @ vectors.T
+    sq = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    return np.sqrt(np.maximum(sq, 0))
+
+
+def _top_k(scores, k, metric):
+    """Indices and scores of the k best columns of each row, best first."""
+    k = min(k, scores.shape[1])
+    ranked = -scores if metric == "cosine" else scores
+    top = np.argpartition(ranked, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(ranked, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(scores, top, axis=1)
+
+
+def default_nprobe(nlist):
+    """FACE_INDEX_NPROBE if set, else IVF_NPROBE_FRACTION of the lists."""
+    if IVF_NPROBE is not None:
+        return IVF_NPROBE
+    return max(1, math.ceil(IVF_NPROBE_FRACTION * nlist))
+
+
+def _empty_result(count, k, metric):
+    fill = -np.inf if metric == "cosine" else np.inf
+    return np.full((count, k), -1, dtype=np.int64), np.full((count, k), fill, dtype=np.float32)
+
+
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, vectors, metric="cosine", prepared=False):
+        self.metric = metric
+        self.vectors = vectors if prepared else _prepare(vectors, metric)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k=1):
+        """Return (indices, scores), each (len(queries), k); missing neighbours are -1."""
+        if len(queries) == 0 or len(self.vectors) == 0:
+            return _empty_result(len(queries), k, self.metric)
+        queries = _prepare(queries, self.metric)
+        indices, scores = _top_k(_scores(queries, self.vectors, self.metric), k, self.metric)
+        if indices.shape[1] < k:
+            pad_indices, pad_scores = _empty_result(len(queries), k - indices.shape[1], self.metric)
+            indices, scores = np.hstack([indices, pad_indices]), np.hstack([scores, pad_scores])
+        return indices, scores
+
+    def save(self, directory):
+        pass
+
+
+def kmeans(vectors, nlist, metric="cosine", iterations=10, seed=0):
+    """Cluster centroids trained on a sample of the vectors (spherical k-means for cosine)."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), nlist * 64), replace=False))]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = _top_k(_scores(sample, centroids, metric), 1, metric)[0][:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if metric == "cosine":
+            centroids = _prepare(centroids, metric)
+    return centroids
+
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, vectors, centroids, order, offsets, metric="cosine", nprobe=IVF_NPROBE):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.metric = metric
+        self.nprobe = nprobe or default_nprobe(len(centroids))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, vectors, metric="cosine", nlist=None, nprobe=None, prepared=False):
+        vectors = vectors if prepared else _prepare(vectors, metric)
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        centroids = kmeans(vectors, nlist, metric)
+
+        # Assign in chunks to bound the size of the score matrix
+        assign = np.concatenate([
+            _top_k(_scores(vectors[start:start + 65536], centroids, metric), 1, metric)[0][:, 0]
+            for start in range(0, len(vectors), 65536)
+        ])
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        return cls(vectors, centroids, order, offsets, metric, nprobe)
+
+    @classmethod
+    def load(cls, directory, vectors, metric="cosine", nprobe=None):
+        return cls(
+            vectors,
+            np.load(os.path.join(directory, "ivf_centroids.npy")),
+            np.load(os.path.join(directory, "ivf_order.npy"), mmap_mode='r'),
+            np.load(os.path.join(directory, "ivf_offsets.npy")),
+            metric,
+            nprobe,
+        )
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "ivf_order.npy"), self.order)
+        np.save(os.path.join(directory, "ivf_offsets.npy"), self.offsets)
+
+    def search(self, queries, k=1):
+        """Return (indices, scores), each (len(queries), k); missing neighbours are -1."""
+        indices, scores = _empty_result(len(queries), k, self.metric)
+        if len(queries) == 0 or len(self.vectors) == 0:
+            return indices, scores
+
+        queries = _prepare(queries, self.metric)
+        probes = _top_k(_scores(queries, self.centroids, self.metric), min(self.nprobe, len(self.centroids)), self.metric)[0]
+
+        # Group (query, list) pairs by list, so each probed list is scored
+        # against all of its queries in one matrix product and merged into
+        # the running top-k of those queries
+        pair_queries = np.repeat(np.arange(len(queries)), probes.shape[1])
+        pair_lists = probes.ravel()
+        by_list = np.argsort(pair_lists, kind="stable")
+        lists, starts = np.unique(pair_lists[by_list], return_index=True)
+        ends = np.append(starts[1:], len(by_list))
+
+        for l, start, end in zip(lists, starts, ends):
+            members = self.order[self.offsets[l]:self.offsets[l + 1]]
+            if len(members) == 0:
+                continue
+            rows = pair_queries[by_list[start:end]]
+            top, top_scores = _top_k(_scores(queries[rows], self.vectors[members], self.metric), k, self.metric)
+            merged_indices = np.hstack([indices[rows], np.asarray(members)[top]])
+            merged_scores = np.hstack([scores[rows], top_scores])
+            best, best_scores = _top_k(merged_scores, k, self.metric)
+            indices[rows] = np.take_along_axis(merged_indices, best, axis=1)
+            scores[rows] = best_scores
+        return indices, scores
+
+
+def build_index(vectors, metric="cosine", kind=FACE_INDEX, prepared=False):
+    """Build the configured index; small galleries always use an exact scan."""
+    if kind == "ivf" and len(vectors) >= IVF_MIN_SIZE:
+        return IVFIndex.build(vectors, metric, prepared=prepared)
+    if kind not in ("exact", "ivf"):
+        raise ValueError(f"Unknown index kind '{kind}'")
+    return ExactIndex(vectors, metric, prepared=prepared)
+
+
+def load_index(directory, vectors, metric="cosine", kind=FACE_INDEX):
+    """Load a saved index for a gallery version, building it in memory if it was not saved."""
+    if kind == "ivf" and os.path.exists(os.path.join(directory, "ivf_centroids.npy")):
+        return IVFIndex.load(directory, vectors, metric)
+    return build_index(vectors, metric, kind, prepared=True)
+
+
+def measure_recall(index, queries, k=1):
+    """Fraction of the exact top-k neighbours that the index also returns."""
+    exact = ExactIndex(index.vectors, index.metric, prepared=True)
+    expected, _ = exact.search(queries, k)
+    found, _ = index.search(queries, k)
+    hits = sum(len(set(e[e >= 0]) & set(f[f >= 0])) for e, f in zip(expected, found))
+    return hits / max(1, int((expected >= 0).sum()))
+
+
+def noisy_queries(vectors, count, metric, same_similarity=0.75, same_distance=0.4, rng=None):
+    """New "photos" of enrolled people: gallery rows plus isotropic noise at a same-person distance.
+
+    For cosine galleries the noise puts a query at about same_similarity to its
+    row (Facenet matches sit just above the 0.7 threshold); for l2 galleries at
+    about same_distance (the dlib threshold is 0.4). Returns (picks, queries).
+    """
+    rng = rng or np.random.default_rng(0)
+    dim = vectors.shape[1]
+    picks = rng.choice(len(vectors), min(count, len(vectors)), replace=False)
+    if metric == "cosine":
+        # A unit vector plus noise of norm r has cosine 1 / sqrt(1 + r^2) to it
+        sigma = np.sqrt((1 / same_similarity ** 2 - 1) / dim)
+    else:
+        sigma = same_distance / np.sqrt(dim)
+    queries = vectors[picks] + rng.normal(0, sigma, (len(picks), dim)).astype(np.float32)
+    return picks, queries
+
+
+if __name__ == "__main__":
+    # Recall and latency of IVF against exact search, on a gallery directory or synthetic data
+    parser = argparse.ArgumentParser(description="Compare IVF and exact gallery search")
+    parser.add_argument("--gallery", help="gallery directory (default: synthetic vectors)")
+    parser.add_argument("--size", type=int, default=100000, help="synthetic gallery size")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="probe settings to compare")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--same-similarity", type=float, default=0.75, help="query-to-row cosine similarity (cosine galleries)")
+    parser.add_argument("--same-distance", type=float, default=0.4, help="query-to-row Euclidean distance (l2 galleries)")
+    parser.add_argument("--min-recall", type=float, default=IVF_RECALL_TARGET,
+                        help="fail if the default nprobe's recall is below this")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.gallery:
+        from deepface_model.gallery_store import open_gallery
+
+        header, _, _, vectors = open_gallery(args.gallery)
+        metric = header["metric"]
+    else:
+        vectors, metric = rng.standard_normal((args.size, args.dim)).astype(np.float32), "cosine"
+    vectors = _prepare(vectors, metric)
+
+    # Queries at a realistic same-person distance; with a tiny jitter every
+    # query lands in its own row's list and recall is 1.0 at any nprobe
+    picks, queries = noisy_queries(vectors, args.queries, metric, args.same_similarity, args.same_distance, rng)
+    own = _scores(_prepare(queries, metric), vectors[picks], metric).diagonal()
+    print(f"[Info] {len(queries)} queries at mean {'similarity' if metric == 'cosine' else 'distance'} "
+          f"{own.mean():.3f} to their own row")
+
+    started = time.perf_counter()
+    ivf = IVFIndex.build(vectors, metric, prepared=True)
+    default = ivf.nprobe
+    print(f"[Info] Built IVF with {len(ivf.centroids)} lists in {time.perf_counter() - started:.2f}s; "
+          f"default nprobe {default}")
+
+    exact = ExactIndex(vectors, metric, prepared=True)
+    started = time.perf_counter()
+    exact.search(queries, args.k)
+    print(f"[Info] exact: {(time.perf_counter() - started) * 1000 / len(queries):.3f} ms/query")
+
+    recalls = {}
+    for nprobe in sorted(set(args.nprobe) | {default}):
+        ivf.nprobe = nprobe
+        started = time.perf_counter()
+        ivf.search(queries, args.k)
+        elapsed = time.perf_counter() - started
+        recalls[nprobe] = measure_recall(ivf, queries, args.k)
+        print(f"[Info] ivf nprobe={nprobe}{' (default)' if nprobe == default else ''}: "
+              f"{elapsed * 1000 / len(queries):.3f} ms/query, recall@{args.k} {recalls[nprobe]:.4f}")
+
+    if recalls[default] < args.min_recall:
+        print(f"[Error] Default nprobe {default} has recall@{args.k} {recalls[default]:.4f}, below {args.min_recall}")
+        sys.exit(1)
+    print(f"[Info] Default nprobe meets the recall@{args.k} target of {args.min_recall}")
@@ -2,75 +2,147 @@ import warnings
 import numpy as np
 import cv2
 from deepface import DeepFace
-import pickle
-import pandas as pd
 import os
 # from deepface import DeepFace
-from sklearn.metrics.pairwise import cosine_similarity
 # import os
-from PIL import Image
+from deepface_model.gallery import GALLERY_DIR, get_gallery
+from deepface_model.gallery_store import dataset_hash, save_gallery
+from deepface_model.index import FACE_INDEX
+from deepface_model.embedding import BATCH_SIZE, DETECTOR_BACKEND, MODEL_NAME, detect_faces, embed_image_file, init_enrollment_worker
+from deepface_model.parallel import ENROLL_WORKERS, run_pool
+from deepface_model.embedding_cache import EMBEDDING_CACHE, EmbeddingCache
+from deepface_model.dedup import deduplicate_faces, make_detection
+from deepface_model.enhancement import ENHANCE_FACES, ENHANCE_MIN_SIZE, enhance_faces
+from deepface_model.prefilter import PREFILTER, PREFILTER_SIZE, filter_tiles
+from deepface_model.roster import ROSTER_CSV, get_roster, image_columns
+from deepface_model.scheduler import embed_faces_shared
+from deepface_model.result_cache import cache_key, get_result_cache
+from metrics.division import MAX_WORKING_PIXELS, TILE_TARGET_SIZE, decode_image, tile_image
+from metrics.telemetry import FACES_FOUND, FAILED_TILES, SKIPPED_TILES, UNKNOWN_FACES, UPLOAD_TILES, span
+
+# Faces with no match in the subject's cohort are searched in the whole gallery
+SUBJECT_FALLBACK = os.getenv("SUBJECT_FALLBACK", "0") == "1"
 
 # Suppress unnecessary warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="deepface")
 warnings.filterwarnings("ignore", category=RuntimeWarning, module="tensorflow")
 
 
-def train_faces(csv_path, encoding_file="face_encodings.pkl"):
-    df = pd.read_csv(csv_path)
-    face_encodings = {}
+def train_faces(csv_path, encoding_file=GALLERY_DIR, cache_file=EMBEDDING_CACHE, model_name=MODEL_NAME, workers=ENROLL_WORKERS):
+    """Build per-student mean encodings, embedding only images not already in the cache.
+
+    Per-image embeddings are cached by file content hash and model name; images
+    that left the dataset are pruned from the cache. New images are embedded
+    across a pool of worker processes.
+    """
+    # Only enrollment reads the dataset through pandas; requests use roster.py
+    import pandas as pd
 
+    df = pd.read_csv(csv_path, skipinitialspace=True)
+    df.columns = [str(column).strip() for column in df.columns]
+    # Only the image columns; name, uin, parent_email and subjects are roster metadata
+    images = image_columns(df.columns)
+    cache = EmbeddingCache(cache_file)
+
+    # Hash every listed image; only hashes missing from the cache get embedded
+    student_images = []
     for index, row in df.iterrows():
         name = row['name']
         # parent_email = row['parent_email']
         # uin = row['uin']
-        image_paths = [path.strip() for path in row[3:] if isinstance(path, str) and path.strip()]
-        encodings = []
+        image_paths = [path.strip() for path in row[images] if isinstance(path, str) and path.strip()]
+        hashes = []
 
         for image_path in image_paths:
             if os.path.exists(image_path):
-                try:
-                    result = DeepFace.represent(image_path, model_name='Facenet', enforce_detection=False)
-                    encodings.append(result[0]['embedding'])
-                except Exception as e:
-                    print(f"[Error] {image_path}: {e}")
+                hashes.append((image_path, cache.hash_file(image_path)))
             else:
                 print(f"[Missing] Image file not found: {image_path}")
 
+        student_images.append((name, hashes))
+
+    all_hashes = [content_hash for _, hashes in student_images for _, content_hash in hashes]
+    cached = cache.get_many(all_hashes, model_name)
+    reused = len(cached)
+
+    # Each distinct new image is embedded once; results are merged in dataset order
+    missing = {}
+    for name, hashes in student_images:
+        for image_path, content_hash in hashes:
+            if content_hash not in cached and content_hash not in missing:
+                missing[content_hash] = image_path
+
+    results = run_pool(
+        embed_image_file,
+        [(image_path, model_name) for image_path in missing.values()],
+        workers=workers,
+        initializer=init_enrollment_worker,
+        initargs=(model_name,),
+        label="Embedding enrollment images",
+    )
+
+    embedded = 0
+    failures = []
+    for (content_hash, image_path), (embedding, error) in zip(missing.items(), results):
+        if error is not None:
+            failures.append((image_path, error))
+            continue
+        cached[content_hash] = embedding
+        cache.put(content_hash, model_name, image_path, embedding)
+        embedded += 1
+
+    for image_path, error in failures:
+        print(f"[Error] {image_path}: {error}")
+
+    removed = cache.prune(
+        model_name,
+        keep_hashes=all_hashes,
+        keep_paths=[image_path for _, hashes in student_images for image_path, _ in hashes],
+    )
+    cache.commit()
+    cache.close()
+
+    names, means, metadata = [], [], []
+    for name, hashes in student_images:
+        encodings = [cached[content_hash] for _, content_hash in hashes if content_hash in cached]
         if encodings:
-            face_encodings[name] = np.mean(encodings, axis=0)
+            names.append(name)
+            means.append(np.mean(encodings, axis=0))
+            metadata.append({"images": len(encodings)})
 
-    with open(encoding_file, 'wb') as f:
-        pickle.dump(face_encodings, f)
+    save_gallery(
+        encoding_file,
+        names,
+        means,
+        model_name,
+        dataset_hash=dataset_hash(f"{name}:{content_hash}" for name, hashes in student_images for _, content_hash in hashes),
+        metadata=metadata,
+        index_kind=FACE_INDEX,
+    )
 
+    print(f"[Info] Embedded {embedded} new images, reused {reused}, pruned {removed} stale, {len(failures)} failed.")
     print(f"[Info] Training complete. Encodings saved to '{encoding_file}'.")
 
-def recognize_face(image_path, encoding_file="face_encodings.pkl", threshold=0.7):
-    if not os.path.exists(encoding_file):
+def recognize_face(image_path, encoding_file=GALLERY_DIR, threshold=0.7):
+    gallery = get_gallery(encoding_file)
+    if not gallery.refresh():
         print(f"[Error] Encoding file '{encoding_file}' not found.")
         return None
 
-    with open(encoding_file, 'rb') as f:
-        face_encodings = pickle.load(f)
-
     if not os.path.exists(image_path):
         print(f"[Error] Input image file '{image_path}' not found.")
         return None
 
     try:
-        result = DeepFace.represent(image_path, model_name='Facenet', enforce_detection=False)
+        with span("embedding"):
+            result = DeepFace.represent(image_path, model_name='Facenet', enforce_detection=False)
         input_embedding = np.array(result[0]['embedding'])
     except Exception as e:
         print(f"[Error] Could not process image: {e}")
         return None
 
-    best_match = None
-    best_score = -1
-
-    for name, encoding in face_encodings.items():
-        similarity = cosine_similarity([input_embedding], [encoding])[0][0]
-        if similarity > best_score:
-            best_score = similarity
-            best_match = name
+    names, scores = gallery.match([input_embedding])
+    best_match, best_score = names[0], scores[0]
 
     if best_score >= threshold:
         print(f"[Match] Recognized as: {best_match} (Similarity: {best_score:.2f})")
@@ -79,57 +151,272 @@ def recognize_face(image_path, encoding_file="face_encodings.pkl", threshold=0.7
         print(f"[No Match] No similar face found (Best similarity: {best_score:.2f})")
         return None
     
-def recognize_faces_in_directory(directory_path, encoding_file="face_encodings.pkl", csv_path="Data/dataset_copy.csv", threshold=0.7):
-    if not os.path.exists(encoding_file):
-        print(f"[Error] Encoding file '{encoding_file}' not found.")
-        return []
+def detect_faces_in_tiles(tiles, prefilter=PREFILTER, stats=None):
+    """Run detection on every tile; returns detections in source-image coordinates.
+
+    With prefilter, tiles without a plausible face are skipped first (see
+    prefilter.py); the number skipped is added to stats["tiles_skipped"].
+    Tiles the detector failed on are counted per source image in
+    stats["failed_sources"], since that image's result is incomplete.
+    """
+    if prefilter:
+        with span("prefilter"):
+            kept = filter_tiles(tiles, stats)
+        SKIPPED_TILES.inc(len(tiles) - len(kept))
+        tiles = kept
 
-    with open(encoding_file, 'rb') as f:
-        face_encodings = pickle.load(f)
+    detections = []
+    for tile in tiles:
+        print(f"\n📷 Processing {tile['name']}...")
 
-    # Load metadata from CSV
-    df = pd.read_csv(csv_path).set_index("name")
+        try:
+            detections.extend(make_detection(tile, face) for face in detect_faces(tile["image"]))
+        except Exception as e:
+            FAILED_TILES.inc()
+            if stats is not None:
+                failed = stats.setdefault("failed_sources", {})
+                source = tile.get("source", tile["name"])
+                failed[source] = failed.get(source, 0) + 1
+            print(f"[Error] Failed to process {tile['name']}: {e}")
+    return detections
 
+def assemble_recognized_faces(names, scores, roster, threshold=0.7):
+    """Turn gallery matches into the unique recognized-faces list, with roster metadata."""
     recognized_faces = {}
 
-    for filename in os.listdir(directory_path):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image_path = os.path.join(directory_path, filename)
-            print(f"\n📷 Processing {filename}...")
-
-            try:
-                results = DeepFace.represent(img_path=image_path, model_name='Facenet', enforce_detection=False)
-
-                for face in results:
-                    input_embedding = np.array(face['embedding'])
-                    best_match = None
-                    best_score = -1
-
-                    for name, encoding in face_encodings.items():
-                        similarity = cosine_similarity([input_embedding], [encoding])[0][0]
-                        if similarity > best_score:
-                            best_score = similarity
-                            best_match = name
-
-                    if best_score >= threshold:
-                        print(f"✅ Found: {best_match} (Similarity: {best_score:.2f})")
-                        if best_match not in recognized_faces:
-                            recognized_faces[best_match] = {
-                                "name": best_match,
-                                "uin": df.loc[best_match, "uin"],
-                                "parent_email": df.loc[best_match, "parent_email"]
-                            }
-                    else:
-                        print(f"❌ Unknown face (Similarity: {best_score:.2f})")
-
-            except Exception as e:
-                print(f"[Error] Failed to process {filename}: {e}")
+    for best_match, best_score in zip(names, scores):
+        if best_score >= threshold:
+            FACES_FOUND.inc()
+            print(f"✅ Found: {best_match} (Similarity: {best_score:.2f})")
+            if best_match not in recognized_faces:
+                student = roster.get(best_match)
+                if student is None:
+                    print(f"[Warning] {best_match} is enrolled but missing from the roster")
+                    student = {}
+                recognized_faces[best_match] = {
+                    "name": best_match,
+                    "uin": student.get("uin"),
+                    "parent_email": student.get("parent_email")
+                }
+        else:
+            UNKNOWN_FACES.inc()
+            print(f"❌ Unknown face (Similarity: {best_score:.2f})")
+
+    return list(recognized_faces.values())
+
+def embed_tiles(tiles, batch_size=BATCH_SIZE, stats=None):
+    """Detect faces in every tile, merge duplicates, and embed the rest in batches.
+
+    Returns (detections, unique, embeddings): every raw detection, the
+    deduplicated detections, and one embedding row per unique detection.
+    """
+    with span("detection"):
+        detections = detect_faces_in_tiles(tiles, stats=stats)
+
+    unique = deduplicate_faces(detections)
+    print(f"\n🧩 {len(detections)} detections, {len(unique)} unique faces ({len(detections) - len(unique)} redundant embeddings avoided)")
+
+    if ENHANCE_FACES and unique:
+        # prepare_face resizes to (input_shape[1], input_shape[0]) as (height, width)
+        input_shape = DeepFace.build_model(MODEL_NAME).input_shape
+        with span("enhancement"):
+            enhanced = enhance_faces(unique, (input_shape[1], input_shape[0]))
+        if stats is not None:
+            stats["faces_enhanced"] = stats.get("faces_enhanced", 0) + enhanced
+
+    with span("embedding"):
+        embeddings = embed_faces_shared([detection["face"] for detection in unique], batch_size=batch_size)
+    return detections, unique, embeddings
+
+def match_cohort(embeddings, gallery, roster, threshold=0.7, subject=None, fallback=SUBJECT_FALLBACK, stats=None):
+    """Match against the students enrolled in subject; without a cohort the whole gallery is searched.
+
+    With fallback, faces that found no match in the cohort are searched in the
+    whole gallery as well. Returns (names, scores) like FaceGallery.match.
+    """
+    cohort = gallery.cohort(subject, roster) if subject else None
+    if cohort is None:
+        return gallery.match(embeddings)
+
+    names, scores = cohort.match(embeddings)
+    fallback_matches = 0
+    misses = np.flatnonzero(scores < threshold)
+    if fallback and len(misses):
+        full_names, full_scores = gallery.match(embeddings[misses])
+        better = full_scores > scores[misses]
+        names[misses[better]] = full_names[better]
+        scores[misses[better]] = full_scores[better]
+        fallback_matches = int((full_scores[better] >= threshold).sum())
+
+    if stats is not None:
+        stats.update({"cohort_size": len(cohort), "fallback_matches": fallback_matches})
+    return names, scores
+
+def match_faces(embeddings, gallery, roster, threshold=0.7, subject=None, stats=None):
+    with span("matching"):
+        names, scores = match_cohort(embeddings, gallery, roster, threshold, subject, stats=stats)
+    recognized_faces = assemble_recognized_faces(names, scores, roster, threshold)
 
     print("\n🧠 Final recognized faces:")
-    for val in recognized_faces.values():
+    for val in recognized_faces:
         print(f" - {val['name']}")
 
-    return list(recognized_faces.values())
+    return recognized_faces
+
+def recognize_faces_in_tiles(tiles, encoding_file=GALLERY_DIR, csv_path=ROSTER_CSV, threshold=0.7, batch_size=BATCH_SIZE, stats=None, subject=None):
+    """Recognize faces in in-memory tiles (dicts with "name" and a BGR "image" array).
+
+    Faces are detected in every tile first, duplicates from overlapping tiles
+    are merged (see dedup.py), and the rest are embedded together in batches
+    of batch_size. Pass a dict as stats to receive detection counts. With a
+    subject, faces are matched against that subject's cohort (see match_cohort).
+    """
+    gallery = get_gallery(encoding_file)
+    if not gallery.refresh():
+        print(f"[Error] Encoding file '{encoding_file}' not found.")
+        return []
+
+    roster = get_roster(csv_path)
+
+    counts = {"tiles_skipped": 0, "faces_enhanced": 0}
+    try:
+        detections, unique, embeddings = embed_tiles(tiles, batch_size, counts)
+    except Exception as e:
+        print(f"[Error] Failed to embed faces: {e}")
+        return []
+
+    if stats is not None:
+        stats.update({
+            "tiles": len(tiles),
+            "tiles_skipped": counts["tiles_skipped"],
+            "faces_enhanced": counts["faces_enhanced"],
+            "tiles_failed": sum(counts.get("failed_sources", {}).values()),
+            "skip_rate": round(counts["tiles_skipped"] / len(tiles), 4) if tiles else 0.0,
+            "detections": len(detections),
+            "unique_faces": len(unique),
+            "embeddings_avoided": len(detections) - len(unique),
+        })
+
+    return match_faces(embeddings, gallery, roster, threshold, subject, stats)
+
+def recognize_faces_in_uploads(uploads, grid_sizes=(3, 4), encoding_file=GALLERY_DIR, csv_path=ROSTER_CSV, threshold=0.7, batch_size=BATCH_SIZE, stats=None, result_cache=None, subject=None):
+    """Recognize faces in a list of (filename, encoded image bytes) uploads.
+
+    Each image's detections and embeddings are cached by its content hash and
+    the pipeline configuration (see result_cache.py), so a photo that was
+    already processed skips decoding, detection, and inference.
+    """
+    gallery = get_gallery(encoding_file)
+    if not gallery.refresh():
+        print(f"[Error] Encoding file '{encoding_file}' not found.")
+        return []
+
+    roster = get_roster(csv_path)
+
+    if result_cache is None:
+        result_cache = get_result_cache()
+    config = {"grid_sizes": tuple(grid_sizes), "model": MODEL_NAME, "detector": DETECTOR_BACKEND,
+              "tile_target": TILE_TARGET_SIZE, "max_pixels": MAX_WORKING_PIXELS,
+              "prefilter": PREFILTER and PREFILTER_SIZE, "enhance": ENHANCE_FACES and ENHANCE_MIN_SIZE}
+
+    counts = {"tiles": 0, "tiles_skipped": 0, "tiles_failed": 0, "faces_enhanced": 0, "detections": 0,
+              "unique_faces": 0, "cache_hits": 0}
+    image_embeddings = []
+    pending = []
+    image_names = set()
+    scales = []
+
+    for filename, data in uploads:
+        key = cache_key(data, config) if result_cache else None
+        entry = result_cache.get(key) if result_cache else None
+        if entry is not None:
+            print(f"\n♻️ Reusing cached results for {filename}")
+            counts["cache_hits"] += 1
+            counts["tiles"] += int(entry["tiles"])
+            counts["detections"] += int(entry["detections"])
+            counts["unique_faces"] += len(entry["embeddings"])
+            image_embeddings.append(entry["embeddings"])
+            continue
+
+        with span("decode"):
+            image, scale = decode_image(data, grid_sizes)
+        if image is None:
+            print(f"[ERROR] Could not load image: {filename}")
+            continue
+        scales.append(scale)
+
+        # Tiles are grouped by source name for dedup, so names must be unique
+        image_name = os.path.splitext(os.path.basename(filename))[0]
+        if image_name in image_names:
+            image_name = f"{image_name}_{len(image_names)}"
+        image_names.add(image_name)
+
+        with span("split_image"):
+            tiles = tile_image(image, image_name, grid_sizes, scale)
+        pending.append((key, image_name, tiles))
+
+    all_tiles = [tile for _, _, tiles in pending for tile in tiles]
+    UPLOAD_TILES.observe(len(all_tiles))
+
+    if all_tiles:
+        try:
+            detections, unique, embeddings = embed_tiles(all_tiles, batch_size, counts)
+        except Exception as e:
+            print(f"[Error] Failed to embed faces: {e}")
+            return []
+
+        failed_sources = counts.pop("failed_sources", {})
+        counts["tiles_failed"] += sum(failed_sources.values())
+        for key, image_name, tiles in pending:
+            rows = [i for i, detection in enumerate(unique) if detection["source"] == image_name]
+            entry = {
+                "boxes": np.array([unique[i]["box"] for i in rows], dtype=np.int32).reshape(-1, 4),
+                "confidences": np.array([unique[i]["confidence"] for i in rows], dtype=np.float32),
+                "embeddings": embeddings[rows],
+                "tiles": np.int32(len(tiles)),
+                "detections": np.int32(sum(detection["source"] == image_name for detection in detections)),
+            }
+            # A partial result must not be replayed for every later upload of the photo
+            if result_cache and image_name not in failed_sources:
+                result_cache.put(key, entry)
+            image_embeddings.append(entry["embeddings"])
+
+        counts["tiles"] += len(all_tiles)
+        counts["detections"] += len(detections)
+        counts["unique_faces"] += len(unique)
+
+    if stats is not None:
+        stats.update(counts)
+        stats["embeddings_avoided"] = counts["detections"] - counts["unique_faces"]
+        # Over the tiles that went through detection; cached images skip the gate entirely
+        stats["skip_rate"] = round(counts["tiles_skipped"] / len(all_tiles), 4) if all_tiles else 0.0
+        if scales:
+            stats["decode_scale"] = round(min(scales), 4)
+
+    embeddings = np.concatenate(image_embeddings) if image_embeddings else np.zeros((0, 0), dtype=np.float32)
+    return match_faces(embeddings, gallery, roster, threshold, subject, stats)
+
+def load_tiles_from_directory(directory_path):
+    """Decode tile images saved on disk (debug mode) into the in-memory tile format."""
+    tiles = []
+    for filename in sorted(os.listdir(directory_path)):
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            image = cv2.imread(os.path.join(directory_path, filename))
+            if image is None:
+                print(f"[Error] Failed to process {filename}: could not decode image")
+                continue
+            tiles.append({"name": filename, "image": image})
+    return tiles
+
+def recognize_faces_in_directory(directory_path, encoding_file=GALLERY_DIR, csv_path=ROSTER_CSV, threshold=0.7, subject=None, stats=None):
+    return recognize_faces_in_tiles(
+        load_tiles_from_directory(directory_path),
+        encoding_file=encoding_file,
+        csv_path=csv_path,
+        threshold=threshold,
+        stats=stats,
+        subject=subject,
+    )
 
 # Example usage
 if __name__ == "__main__":
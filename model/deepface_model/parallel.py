@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Process pool for enrollment. Workers are spawned rather than forked, since
+# TensorFlow and dlib state does not survive a fork, and each worker builds
+# its model once in the initializer.
+
+ENROLL_WORKERS = int(os.getenv("ENROLL_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def _call(func, item):
+    try:
+        return func(item), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def iter_pool(func, items, workers=ENROLL_WORKERS, initializer=None, initargs=(), max_pending=None):
+    """Apply func to every item, yielding (index, result, error) as items finish.
+
+    At most max_pending items (default 4 per worker) are in flight, so long
+    inputs are consumed lazily. With workers <= 1 everything runs in this
+    process, in order, and the initializer is skipped.
+    """
+    if workers <= 1:
+        for i, item in enumerate(items):
+            yield (i, *_call(func, item))
+        return
+
+    max_pending = max_pending or workers * 4
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=initializer, initargs=initargs) as pool:
+        pending = {}
+        items = iter(enumerate(items))
+        while True:
+            for i, item in items:
+                pending[pool.submit(_call, func, item)] = i
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    result, error = future.result()
+                except Exception as e:
+                    # The worker process itself died
+                    result, error = None, f"{type(e).__name__}: {e}"
+                yield i, result, error
+
+
+def run_pool(func, items, workers=ENROLL_WORKERS, initializer=None, initargs=(), label="Processing"):
+    """Apply func to every item and return [(result, error)] in input order.
+
+    A failing item yields (None, message) instead of aborting the run. With
+    workers <= 1 everything runs in this process and the initializer, which
+    is meant for pool workers, is skipped.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    total = len(items)
+    step = max(1, total // 20)
+
+    workers = min(workers, total) if total > 1 else 1
+    for done, (i, result, error) in enumerate(iter_pool(func, items, workers, initializer, initargs, max_pending=total), start=1):
+        results[i] = (result, error)
+        if done == total or done % step == 0:
+            print(f"[Progress] {label}: {done}/{total}")
+    return results
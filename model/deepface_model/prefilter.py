@@ -0,0 +1,148 @@
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+import cv2
+
+# Cheap gate in front of detection. Most tiles of a classroom photo are walls,
+# ceiling, or desks, yet each one pays a full extract_faces pass, and with
+# enforce_detection=False the empty tile comes back as a whole-tile "face"
+# that is embedded too. A tile is skipped only when a downscaled Haar pass with
+# much looser settings than the detector's (1 neighbour instead of 10) finds
+# no candidate at all. `python -m deepface_model.prefilter` checks recall on
+# the bundled images.
+
+PREFILTER = os.getenv("TILE_PREFILTER", "1") == "1"
+# Long side of the grayscale copy the cascade runs on
+PREFILTER_SIZE = int(os.getenv("TILE_PREFILTER_SIZE", "320"))
+# Laplacian variance below this is a blank surface (wall, ceiling, whiteboard)
+MIN_TEXTURE = float(os.getenv("TILE_PREFILTER_MIN_TEXTURE", "10"))
+# The frontal-face cascade window; nothing smaller can be detected
+MIN_FACE_SIZE = 24
+SCALE_FACTOR = 1.1
+MIN_NEIGHBORS = 1
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+# CascadeClassifier is not thread-safe, so request threads each load their own
+_local = threading.local()
+_missing_warned = False
+
+
+def _cascade():
+    global _missing_warned
+    cascade = getattr(_local, "cascade", None)
+    if cascade is None:
+        try:
+            cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, CASCADE_FILE))
+        except AttributeError:
+            # OpenCV 5 moved the Haar cascades out of the main package
+            cascade = None
+        if cascade is None or cascade.empty():
+            if not _missing_warned:
+                print(f"[Warning] {CASCADE_FILE} not found; the tile pre-filter is disabled")
+                _missing_warned = True
+            cascade = False
+        _local.cascade = cascade
+    return cascade
+
+
+def may_contain_face(image, size=PREFILTER_SIZE, min_texture=MIN_TEXTURE):
+    """False only when a BGR tile has no plausible face; errs on the side of True."""
+    height, width = image.shape[:2]
+    if min(height, width) < MIN_FACE_SIZE:
+        return False
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    factor = size / max(height, width)
+    if factor < 1:
+        gray = cv2.resize(gray, (max(1, round(width * factor)), max(1, round(height * factor))), interpolation=cv2.INTER_AREA)
+
+    if min_texture and cv2.Laplacian(gray, cv2.CV_64F).var() < min_texture:
+        return False
+
+    cascade = _cascade()
+    if cascade is False:
+        return True
+
+    min_size = (min(20, gray.shape[1]), min(20, gray.shape[0]))
+    return len(cascade.detectMultiScale(gray, SCALE_FACTOR, MIN_NEIGHBORS, minSize=min_size)) > 0
+
+
+def filter_tiles(tiles, stats=None):
+    """Tiles that may contain a face; adds the number skipped to stats["tiles_skipped"]."""
+    kept = [tile for tile in tiles if may_contain_face(tile["image"])]
+    if stats is not None:
+        stats["tiles_skipped"] = stats.get("tiles_skipped", 0) + len(tiles) - len(kept)
+    return kept
+
+
+if __name__ == "__main__":
+    # Recall check: detect on every tile, then only on the tiles the gate keeps,
+    # and count real faces (after dedup) and recognized students that go missing
+    from deepface_model.dedup import box_overlap, deduplicate_faces
+    from deepface_model.embedding import embed_faces
+    from deepface_model.gallery import GALLERY_DIR, get_gallery
+    from deepface_model.main import detect_faces_in_tiles
+    from metrics.division import decode_image, tile_image
+
+    parser = argparse.ArgumentParser(description="Measure the tile pre-filter's skip rate and recall")
+    parser.add_argument("--sets", nargs="+", default=["test", "test_folder"], help="image directories")
+    parser.add_argument("--encoding-file", default=GALLERY_DIR)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    args = parser.parse_args()
+
+    gallery = get_gallery(args.encoding_file)
+    gallery.refresh()
+
+    totals = {"tiles": 0, "skipped": 0, "faces": 0, "lost_faces": 0, "students": 0, "lost_students": 0}
+    timings = {"gate": 0.0, "detect_all": 0.0, "detect_kept": 0.0}
+    paths = sorted(path for directory in args.sets for path in glob.glob(os.path.join(directory, "*"))
+                   if path.lower().endswith((".jpg", ".jpeg", ".png")))
+
+    for path in paths:
+        with open(path, "rb") as f:
+            image, scale = decode_image(f.read())
+        if image is None:
+            continue
+        tiles = tile_image(image, os.path.splitext(os.path.basename(path))[0], (3, 4), scale)
+
+        started = time.perf_counter()
+        kept = filter_tiles(tiles)
+        timings["gate"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        all_unique = deduplicate_faces(detect_faces_in_tiles(tiles, prefilter=False))
+        timings["detect_all"] += time.perf_counter() - started
+        started = time.perf_counter()
+        kept_unique = deduplicate_faces(detect_faces_in_tiles(kept, prefilter=False))
+        timings["detect_kept"] += time.perf_counter() - started
+
+        # Whole-tile fallbacks are not faces, but they are embedded, so they count for students
+        everything = [d for d in all_unique if not d["fallback"]]
+        gated = [d for d in kept_unique if not d["fallback"]]
+
+        lost = [d for d in everything if not any(
+            iou >= 0.4 or overlap >= 0.7 for iou, overlap in (box_overlap(d["box"], g["box"]) for g in gated))]
+
+        def students(detections):
+            names, scores = gallery.match(embed_faces([d["face"] for d in detections]))
+            return {name for name, score in zip(names, scores) if score >= args.threshold}
+
+        expected, found = students(all_unique), students(kept_unique)
+        totals["tiles"] += len(tiles)
+        totals["skipped"] += len(tiles) - len(kept)
+        totals["faces"] += len(everything)
+        totals["lost_faces"] += len(lost)
+        totals["students"] += len(expected)
+        totals["lost_students"] += len(expected - found)
+        print(f"[Info] {path}: skipped {len(tiles) - len(kept)}/{len(tiles)} tiles, "
+              f"lost {len(lost)}/{len(everything)} faces, missing students {sorted(expected - found)}")
+
+    skip_rate = totals["skipped"] / totals["tiles"] if totals["tiles"] else 0.0
+    print(f"[Info] Skip rate {skip_rate:.1%} over {totals['tiles']} tiles; "
+          f"lost {totals['lost_faces']}/{totals['faces']} faces and {totals['lost_students']}/{totals['students']} students")
+    print(f"[Info] Gate {timings['gate']:.1f}s, detection on all tiles {timings['detect_all']:.1f}s, "
+          f"on kept tiles {timings['detect_kept']:.1f}s")
+    sys.exit(1 if totals["lost_faces"] or totals["lost_students"] else 0)
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics.telemetry import Counter
+
+# Detections and embeddings per uploaded image, keyed by the image bytes and
+# the pipeline configuration, so re-uploads of the same photo skip detection
+# and inference. A bounded in-memory LRU sits in front of a bounded disk tier
+# that is shared by all workers on the host.
+
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MEMORY_MB = float(os.getenv("RESULT_CACHE_MEMORY_MB", "64"))
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "1024"))
+
+CACHE_HITS = Counter("attendance_result_cache_hits_total", "Result cache hits by tier.")
+CACHE_MISSES = Counter("attendance_result_cache_misses_total", "Result cache misses.")
+CACHE_EVICTIONS = Counter("attendance_result_cache_evictions_total", "Result cache evictions by tier.")
+
+
+def cache_key(data, config):
+    """Hash of the image bytes plus a description of everything that affects the result."""
+    digest = hashlib.sha256(data)
+    digest.update(repr(sorted(config.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def entry_size(entry):
+    return sum(value.nbytes for value in entry.values() if isinstance(value, np.ndarray))
+
+
+class ResultCache:
+    def __init__(self, directory=RESULT_CACHE_DIR, memory_bytes=RESULT_CACHE_MEMORY_MB * 1e6, disk_bytes=RESULT_CACHE_DISK_MB * 1e6):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        if disk_bytes > 0:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Return the cached entry (a dict of arrays) or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                CACHE_HITS.inc(tier="memory")
+                return entry
+
+        if self.disk_bytes > 0:
+            path = self._path(key)
+            try:
+                with np.load(path) as data:
+                    entry = {name: data[name] for name in data.files}
+                # Refresh the mtime, which the disk tier evicts by
+                os.utime(path)
+            except (FileNotFoundError, OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                with self._lock:
+                    self.hits["disk"] += 1
+                CACHE_HITS.inc(tier="disk")
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        CACHE_MISSES.inc()
+        return None
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self.disk_bytes > 0:
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **entry)
+            os.replace(tmp, path)
+            self._account_disk(os.path.getsize(path))
+
+    def _remember(self, key, entry):
+        size = entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= entry_size(self._memory.pop(key))
+            self._memory[key] = entry
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= entry_size(evicted)
+                CACHE_EVICTIONS.inc(tier="memory")
+
+    def _scan_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        return files
+
+    def _account_disk(self, size):
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_used += size
+            if self._disk_used <= self.disk_bytes:
+                return
+
+            # Other workers write here too, so rescan before evicting down to 90%
+            files = sorted(self._scan_disk())
+            used = sum(size for _, size, _ in files)
+            for _, size, name in files:
+                if used <= self.disk_bytes * 0.9:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                used -= size
+                CACHE_EVICTIONS.inc(tier="disk")
+            self._disk_used = used
+
+    def counters(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": self.misses, "memory_bytes": self._memory_used, "entries": len(self._memory)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide cache, or None when RESULT_CACHE=0."""
+    global _cache
+    if not RESULT_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+    return _cache
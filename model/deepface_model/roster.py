@@ -0,0 +1,104 @@
+import csv
+import os
+import threading
+
+ROSTER_CSV = os.getenv("ROSTER_CSV", "Data/dataset_copy.csv")
+
+
+def image_columns(columns):
+    """The roster columns that hold image paths: image, image1, image2, ..."""
+    return [column for column in columns if str(column).strip().lower().startswith("image")]
+
+
+class Roster:
+    """Student metadata from the roster CSV, indexed by name, UIN, and subject.
+
+    The CSV needs a name column; uin, parent_email and an optional subjects
+    column (separated by ';') are read when present. Empty cells become None.
+    The file is reloaded only when its mtime changes, like FaceGallery.
+    """
+
+    def __init__(self, csv_path=ROSTER_CSV):
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        # The three indexes are swapped together so readers never see a mix
+        self._data = ({}, {}, {})
+
+    def __len__(self):
+        return len(self._data[0])
+
+    @property
+    def version(self):
+        """Changes whenever the roster is reloaded; used to invalidate derived caches."""
+        return self._mtime
+
+    def __contains__(self, name):
+        return name in self._data[0]
+
+    def refresh(self):
+        """Load the roster if it changed since the last load. Returns False if it is missing."""
+        try:
+            mtime = os.stat(self.csv_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+        if mtime == self._mtime:
+            return True
+
+        with self._lock:
+            if mtime == self._mtime:
+                return True
+
+            by_name, by_uin, by_subject = {}, {}, {}
+            with open(self.csv_path, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f, skipinitialspace=True)
+                for row in reader:
+                    row = {(key or "").strip(): (value.strip() or None) if isinstance(value, str) else None
+                           for key, value in row.items()}
+                    name = row.get("name")
+                    # The first row wins, as it did with DataFrame.loc on a unique index
+                    if not name or name in by_name:
+                        continue
+                    student = {
+                        "name": name,
+                        "uin": row.get("uin"),
+                        "parent_email": row.get("parent_email"),
+                        "subjects": tuple(s.strip() for s in (row.get("subjects") or "").split(";") if s.strip()),
+                    }
+                    by_name[name] = student
+                    if student["uin"]:
+                        by_uin[student["uin"]] = student
+                    for subject in student["subjects"]:
+                        by_subject.setdefault(subject, []).append(student)
+
+            self._data = (by_name, by_uin, by_subject)
+            self._mtime = mtime
+            print(f"[Info] Loaded {len(by_name)} students from '{self.csv_path}'.")
+        return True
+
+    def get(self, name):
+        """Metadata dict for a student name, or None."""
+        return self._data[0].get(name)
+
+    def by_uin(self, uin):
+        return self._data[1].get(uin)
+
+    def students_in(self, subject):
+        """Students enrolled in a subject (empty if the roster has no subjects column)."""
+        return list(self._data[2].get(subject, ()))
+
+
+_rosters = {}
+_rosters_lock = threading.Lock()
+
+
+def get_roster(csv_path=ROSTER_CSV):
+    """Per-process roster for a CSV file, refreshed on every call."""
+    with _rosters_lock:
+        roster = _rosters.get(csv_path)
+        if roster is None:
+            roster = _rosters[csv_path] = Roster(csv_path)
+    if not roster.refresh():
+        print(f"[Error] Roster file '{csv_path}' not found.")
+    return roster
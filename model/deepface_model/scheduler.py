@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+from deepface import DeepFace
+from deepface_model.embedding import BATCH_SIZE, MODEL_NAME, embed_faces, prepare_face
+from metrics.telemetry import Gauge, Histogram
+
+# Shared inference scheduler. Concurrent requests in one worker process (gthread
+# request threads, background job workers) hand their face crops to a single
+# queue. One model thread drains it in micro-batches: a batch is sent to the
+# model when it reaches MICRO_BATCH_SIZE crops, or MICRO_BATCH_WAIT_MS after its
+# first crop arrived, whichever comes first. Every embedding row is routed back
+# to the request that produced it.
+
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "1") == "1"
+MICRO_BATCH_SIZE = int(os.getenv("MICRO_BATCH_SIZE", str(BATCH_SIZE)))
+MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "5"))
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))
+# A request gives up on its embeddings after this long instead of hanging
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "300"))
+
+QUEUE_DEPTH = Gauge("attendance_inference_queue_depth", "Face crops waiting for the shared embedding model.")
+BATCH_SIZES = Histogram(
+    "attendance_inference_batch_size",
+    "Face crops per forward pass of the shared embedding model.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUEUE_WAIT = Histogram("attendance_inference_queue_wait_seconds", "Time a face crop waited before its forward pass.")
+
+
+class InferenceScheduler:
+    def __init__(self, model_name=MODEL_NAME, max_batch=MICRO_BATCH_SIZE, max_wait=MICRO_BATCH_WAIT_MS / 1000,
+                 threads=INFERENCE_THREADS):
+        self.model_name = model_name
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.threads = max(1, threads)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def start(self):
+        """Start the model threads in this process (once per process, so it is fork-safe)."""
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._started_pid == os.getpid():
+            return
+        # A queue inherited across fork may hold a lock taken by a parent thread
+        self._queue = queue.Queue()
+        self._started_pid = os.getpid()
+        for i in range(self.threads):
+            threading.Thread(target=self._model_loop, name=f"inference-{i}", daemon=True).start()
+
+    def embed(self, faces, timeout=INFERENCE_TIMEOUT):
+        """Embed face crops through the shared queue; returns a (len(faces), dim) float32 array."""
+        if not faces:
+            return embed_faces([], self.model_name)
+
+        # Preprocessing runs on the calling thread; only the forward pass is shared
+        target_size = DeepFace.build_model(self.model_name).input_shape
+        request = {
+            "rows": [None] * len(faces),
+            "remaining": len(faces),
+            "error": None,
+            "done": threading.Event(),
+        }
+
+        inputs = [prepare_face(face, target_size) for face in faces]
+        # Under the lock, so a model thread that failed to start cannot drop these crops
+        with self._lock:
+            self._start_locked()
+            now = time.perf_counter()
+            for index, face_inputs in enumerate(inputs):
+                self._queue.put((request, index, face_inputs, now))
+        QUEUE_DEPTH.set(self._queue.qsize())
+
+        if not request["done"].wait(timeout):
+            raise TimeoutError(f"Embedding {len(faces)} faces timed out after {timeout}s")
+        if request["error"] is not None:
+            raise request["error"]
+        return np.stack(request["rows"])
+
+    def _collect(self):
+        """Block for one crop, then gather more until the batch is full or the wait runs out."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return batch
+
+    def _fail_start(self, error):
+        """Fail every queued request and let the next embed() start fresh model threads."""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                self._started_pid = None
+            while True:
+                try:
+                    request, _, _, _ = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                request["error"] = error
+                request["done"].set()
+        QUEUE_DEPTH.set(0)
+
+    def _model_loop(self):
+        try:
+            model = DeepFace.build_model(self.model_name)
+        except Exception as e:
+            print(f"[Error] Shared inference could not load {self.model_name}: {e}")
+            self._fail_start(e)
+            return
+
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, _, enqueued_at in batch:
+                QUEUE_WAIT.observe(started - enqueued_at)
+            BATCH_SIZES.observe(len(batch))
+
+            try:
+                inputs = np.concatenate([inputs for _, _, inputs, _ in batch])
+                embeddings = model.model(inputs, training=False).numpy().astype(np.float32)
+            except Exception as e:
+                print(f"[Error] Shared inference failed for {len(batch)} faces: {e}")
+                embeddings, error = None, e
+            else:
+                error = None
+
+            with self._lock:
+                for row, (request, index, _, _) in enumerate(batch):
+                    if error is not None:
+                        request["error"] = error
+                    else:
+                        request["rows"][index] = embeddings[row]
+                    request["remaining"] -= 1
+                    if request["remaining"] == 0:
+                        request["done"].set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide scheduler, or None when INFERENCE_BATCHING=0."""
+    global _scheduler
+    if not INFERENCE_BATCHING:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+    return _scheduler
+
+
+def embed_faces_shared(faces, batch_size=BATCH_SIZE):
+    """Embed through the shared scheduler, or in local batches of batch_size when it is disabled."""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return embed_faces(faces, batch_size=batch_size)
+    return scheduler.embed(faces)
@@ -0,0 +1,215 @@
+import os
+import time
+import cv2
+import numpy as np
+from deepface_model.dedup import box_overlap
+from deepface_model.embedding import BATCH_SIZE, detect_faces
+from deepface_model.roster import ROSTER_CSV, get_roster
+from deepface_model.scheduler import embed_faces_shared
+from deepface_model.gallery import GALLERY_DIR, get_gallery, normalize_rows
+from deepface_model.main import assemble_recognized_faces, match_cohort
+from metrics.telemetry import span
+
+# Attendance from a classroom video. Frames are sampled adaptively (densely
+# while people move in or out of view, sparsely while the scene is stable),
+# detection runs on downscaled frames, and detections are linked across
+# frames into tracks. Each track is embedded a few times and matched once,
+# instead of embedding every face in every frame.
+
+SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+# While nothing changes the sampling interval doubles up to this many seconds
+MAX_SAMPLE_INTERVAL = float(os.getenv("VIDEO_MAX_SAMPLE_INTERVAL", "2"))
+DETECT_WIDTH = int(os.getenv("VIDEO_DETECT_WIDTH", "960"))
+CROPS_PER_TRACK = 3
+# Tracks seen in fewer sampled frames are treated as false detections
+MIN_TRACK_HITS = 2
+TRACK_IOU = 0.3
+MAX_MISSED = 4
+
+
+class FaceTracker:
+    """Greedy IoU tracker with a centroid-distance fallback for fast movement."""
+
+    def __init__(self, iou_threshold=TRACK_IOU, max_missed=MAX_MISSED, crops_per_track=CROPS_PER_TRACK):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.crops_per_track = crops_per_track
+        self.active = []
+        self.finished = []
+        self._next_id = 0
+
+    def _affinity(self, track, box):
+        iou, _ = box_overlap(track["box"], box)
+        if iou >= self.iou_threshold:
+            return iou
+        # Same face if the centres are within one face width of each other
+        tx, ty = track["box"][0] + track["box"][2] / 2, track["box"][1] + track["box"][3] / 2
+        bx, by = box[0] + box[2] / 2, box[1] + box[3] / 2
+        distance = np.hypot(tx - bx, ty - by)
+        limit = max(track["box"][2], box[2])
+        return 0.0 if distance > limit else 0.01 * (1 - distance / limit)
+
+    def _add_crop(self, track, detection, frame_index):
+        crops = track["crops"]
+        crops.append((detection["confidence"], frame_index, detection["face"]))
+        # Keep the most confident crops, at most one per sampled frame
+        crops.sort(key=lambda crop: (-crop[0], crop[1]))
+        del crops[self.crops_per_track:]
+
+    def update(self, detections, frame_index):
+        """Assign detections to tracks; returns how many tracks started or ended."""
+        pairs = sorted(
+            ((self._affinity(track, detection["box"]), t, d)
+             for t, track in enumerate(self.active)
+             for d, detection in enumerate(detections)),
+            reverse=True,
+        )
+        matched_tracks, matched_detections = set(), set()
+        for affinity, t, d in pairs:
+            if affinity <= 0 or t in matched_tracks or d in matched_detections:
+                continue
+            track = self.active[t]
+            track["box"] = detections[d]["box"]
+            track["last_seen"] = frame_index
+            track["missed"] = 0
+            track["hits"] += 1
+            self._add_crop(track, detections[d], frame_index)
+            matched_tracks.add(t)
+            matched_detections.add(d)
+
+        changes = 0
+        still_active = []
+        for t, track in enumerate(self.active):
+            if t not in matched_tracks:
+                track["missed"] += 1
+            if track["missed"] > self.max_missed:
+                self.finished.append(track)
+                changes += 1
+            else:
+                still_active.append(track)
+        self.active = still_active
+
+        for d, detection in enumerate(detections):
+            if d in matched_detections:
+                continue
+            track = {"id": self._next_id, "box": detection["box"], "first_seen": frame_index,
+                     "last_seen": frame_index, "missed": 0, "hits": 1, "crops": []}
+            self._add_crop(track, detection, frame_index)
+            self.active.append(track)
+            self._next_id += 1
+            changes += 1
+        return changes
+
+    def tracks(self):
+        return self.finished + self.active
+
+
+def detect_in_frame(frame, detect_width=DETECT_WIDTH):
+    """Detect faces on a downscaled copy of the frame; whole-frame fallbacks are dropped."""
+    height, width = frame.shape[:2]
+    if width > detect_width:
+        frame = cv2.resize(frame, (detect_width, int(height * detect_width / width)), interpolation=cv2.INTER_AREA)
+        height, width = frame.shape[:2]
+
+    detections = []
+    for face in detect_faces(frame):
+        area = face['facial_area']
+        box = (area['x'], area['y'], area['w'], area['h'])
+        if box[0] == 0 and box[1] == 0 and box[2] >= width and box[3] >= height:
+            continue
+        detections.append({"box": box, "confidence": face.get('confidence') or 0, "face": face['face']})
+    return detections
+
+
+def track_faces_in_video(video_path, sample_fps=SAMPLE_FPS, max_interval=MAX_SAMPLE_INTERVAL, stats=None):
+    """Decode a video, sample frames adaptively, and return the face tracks."""
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    base_step = max(1, int(round(fps / sample_fps)))
+    max_step = max(base_step, int(round(fps * max_interval)))
+    step = base_step
+
+    tracker = FaceTracker()
+    frame_index = 0
+    next_sample = 0
+    sampled = 0
+
+    try:
+        while True:
+            # grab() skips the colour conversion and copy for frames we do not sample
+            if not capture.grab():
+                break
+            if frame_index == next_sample:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                with span("detection"):
+                    detections = detect_in_frame(frame)
+                changes = tracker.update(detections, frame_index)
+                sampled += 1
+                # Sample densely while tracks start or end, back off while the scene is stable
+                step = base_step if changes else min(max_step, step * 2)
+                next_sample = frame_index + step
+            frame_index += 1
+    finally:
+        capture.release()
+
+    tracks = tracker.tracks()
+    if stats is not None:
+        stats.update({
+            "frames": frame_index,
+            "sampled_frames": sampled,
+            "video_seconds": frame_index / fps,
+            "tracks": len(tracks),
+        })
+    return tracks
+
+
+def recognize_faces_in_video(video_path, encoding_file=GALLERY_DIR, csv_path=ROSTER_CSV, threshold=0.7, batch_size=BATCH_SIZE, stats=None, subject=None):
+    """Recognize the students in a video; returns the same list as recognize_faces_in_tiles."""
+    gallery = get_gallery(encoding_file)
+    if not gallery.refresh():
+        print(f"[Error] Encoding file '{encoding_file}' not found.")
+        return []
+
+    roster = get_roster(csv_path)
+
+    started = time.perf_counter()
+    stats = stats if stats is not None else {}
+    tracks = [track for track in track_faces_in_video(video_path, stats=stats) if track["hits"] >= MIN_TRACK_HITS]
+
+    crops = [crop for track in tracks for _, _, crop in track["crops"]]
+    try:
+        with span("embedding"):
+            embeddings = embed_faces_shared(crops, batch_size=batch_size)
+    except Exception as e:
+        # stats gets no matched_tracks, so the caller can tell the video was not processed
+        print(f"[Error] Failed to embed faces: {e}")
+        return []
+
+    # One averaged embedding per track
+    track_embeddings = []
+    offset = 0
+    for track in tracks:
+        count = len(track["crops"])
+        track_embeddings.append(normalize_rows(embeddings[offset:offset + count]).mean(axis=0))
+        offset += count
+
+    track_embeddings = np.array(track_embeddings, dtype=np.float32) if tracks else np.zeros((0, 0), dtype=np.float32)
+    with span("matching"):
+        names, scores = match_cohort(track_embeddings, gallery, roster, threshold, subject, stats=stats)
+    recognized_faces = assemble_recognized_faces(names, scores, roster, threshold)
+
+    elapsed = time.perf_counter() - started
+    stats.update({
+        "matched_tracks": len(tracks),
+        "embedded_crops": len(crops),
+        "processing_seconds": elapsed,
+        "realtime_factor": stats["video_seconds"] / elapsed if elapsed else 0.0,
+    })
+    print(f"[Info] {stats['frames']} frames, {stats['sampled_frames']} sampled, {len(tracks)} tracks, "
+          f"{len(crops)} crops embedded in {elapsed:.1f}s ({stats['realtime_factor']:.1f}x real time)")
+    return recognized_faces
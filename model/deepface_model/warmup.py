@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+import cv2
+from deepface import DeepFace
+from deepface_model.embedding import BATCH_SIZE, MODEL_NAME, detect_faces, embed_faces
+from deepface_model.engines import get_engine
+from deepface_model.gallery import GALLERY_DIR, get_gallery
+from deepface_model.roster import get_roster
+
+# Builds the detector and Facenet once per worker and runs one inference on a
+# bundled image, so the first real /upload does not pay for weight loading and
+# graph tracing. Readiness is exposed through /readyz.
+
+WARMUP_IMAGE = os.getenv("WARMUP_IMAGE", "images/yedi.jpg")
+
+_state = {"ready": False, "warming": False, "error": None, "pid": None, "timings": {}}
+_lock = threading.Lock()
+
+
+def warm_up(sample_image=WARMUP_IMAGE, encoding_file=GALLERY_DIR):
+    """Load models, gallery, and roster and run a warm-up inference; returns per-phase timings in seconds."""
+    timings = {}
+    started = time.perf_counter()
+
+    DeepFace.build_model(MODEL_NAME)
+    timings["model_load"] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    get_gallery(encoding_file).refresh()
+    # Video and the debug tile path always use DeepFace; uploads use the configured engine
+    get_engine().load_gallery()
+    get_roster()
+    timings["gallery_load"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    image = cv2.imread(sample_image)
+    if image is None:
+        raise FileNotFoundError(f"Warm-up image '{sample_image}' not found")
+    faces = [face['face'] for face in detect_faces(image)]
+    timings["detection"] = time.perf_counter() - phase
+
+    # One single-face pass and one full batch, so both shapes are traced
+    phase = time.perf_counter()
+    embed_faces(faces[:1], batch_size=1)
+    embed_faces((faces * BATCH_SIZE)[:BATCH_SIZE])
+    timings["embedding"] = time.perf_counter() - phase
+
+    timings["total"] = time.perf_counter() - started
+    return timings
+
+
+def _run():
+    try:
+        timings = warm_up()
+    except Exception as e:
+        with _lock:
+            _state.update(warming=False, error=str(e))
+        print(f"[Error] Warm-up failed in worker {os.getpid()}: {e}")
+        return
+
+    with _lock:
+        _state.update(ready=True, warming=False, error=None, timings=timings)
+    details = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items() if phase != "total")
+    print(f"[Info] Worker {os.getpid()} ready: cold start {timings['total']:.2f}s ({details})")
+
+
+def start_warm_up(background=True):
+    """Start warming this process once (safe to call from gunicorn's post_fork)."""
+    with _lock:
+        if _state["pid"] == os.getpid() and (_state["ready"] or _state["warming"]):
+            return
+        # State inherited from a preloaded master does not apply to this worker
+        _state.update(ready=False, warming=True, error=None, pid=os.getpid(), timings={})
+
+    if background:
+        threading.Thread(target=_run, name="warm-up", daemon=True).start()
+    else:
+        _run()
+
+
+def readiness():
+    with _lock:
+        return dict(_state, timings=dict(_state["timings"]))
@@ -0,0 +1,23 @@
+import os
+
+# gunicorn -c gunicorn.conf.py api.app:app
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Request threads per worker; concurrent uploads share one model through the
+# micro-batching scheduler in deepface_model/scheduler.py
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "500"))
+# With preload the app (and TensorFlow) is imported once in the master, but
+# models are still built after the fork: TensorFlow state is not fork-safe
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+
+def post_fork(server, worker):
+    from api.app import job_queue
+    from api.outbox import get_outbox
+    from deepface_model.warmup import start_warm_up
+
+    start_warm_up()
+    # Jobs and emails queued before a restart are picked up now, not after the next upload
+    job_queue.start()
+    get_outbox().start()
@@ -0,0 +1,225 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from metrics.division import decode_image, tile_image
+from deepface import DeepFace
+from deepface_model.dedup import deduplicate_faces
+from deepface_model.embedding import BATCH_SIZE, MODEL_NAME
+from deepface_model.enhancement import ENHANCE_FACES, enhance_faces
+from deepface_model.gallery import GALLERY_DIR, get_gallery
+from deepface_model.index import FACE_INDEX
+from deepface_model.roster import get_roster
+from deepface_model.main import assemble_recognized_faces, detect_faces_in_tiles
+from deepface_model.scheduler import INFERENCE_BATCHING, MICRO_BATCH_SIZE, embed_faces_shared
+
+# Times every stage of the /upload pipeline separately over the bundled image
+# sets and writes a JSON report that can be diffed between versions:
+#
+#   python -m metrics.benchmark --repeat 3 --out bench.json
+#
+# Each set gets one cold run in a fresh process (model loading and graph
+# tracing included) and --repeat warm runs in this process after a warm-up.
+# Stages call the same functions as main.embed_tiles, so embeddings go through
+# the shared inference scheduler and ENHANCE_FACES=1 is measured too.
+
+DEFAULT_SETS = ("test_folder", "test", "images")
+STAGES = ("read", "decode", "split_image", "detection", "dedup", "enhancement", "embedding", "matching", "assembly")
+GRID_SIZES = (3, 4)
+
+
+def list_images(folder):
+    return [
+        os.path.join(folder, filename)
+        for filename in sorted(os.listdir(folder))
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+    ]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] += time.perf_counter() - started
+
+
+def run_once(paths, gallery, roster, batch_size=BATCH_SIZE):
+    """Run the pipeline once per image (one image = one upload); returns per-stage seconds and counts."""
+    timings = defaultdict(float)
+    counts = defaultdict(int)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for path in paths:
+            with timed(timings, "read"):
+                with open(path, 'rb') as f:
+                    data = f.read()
+            with timed(timings, "decode"):
+                image, scale = decode_image(data, GRID_SIZES)
+            if image is None:
+                counts["failed_images"] += 1
+                continue
+            with timed(timings, "split_image"):
+                tiles = tile_image(image, os.path.splitext(os.path.basename(path))[0], GRID_SIZES, scale)
+            with timed(timings, "detection"):
+                detections = detect_faces_in_tiles(tiles, stats=counts)
+            with timed(timings, "dedup"):
+                unique = deduplicate_faces(detections)
+            if ENHANCE_FACES and unique:
+                input_shape = DeepFace.build_model(MODEL_NAME).input_shape
+                with timed(timings, "enhancement"):
+                    counts["faces_enhanced"] += enhance_faces(unique, (input_shape[1], input_shape[0]))
+            faces = [detection["face"] for detection in unique]
+            with timed(timings, "embedding"):
+                embeddings = embed_faces_shared(faces, batch_size=batch_size)
+            with timed(timings, "matching"):
+                names, scores = gallery.match(embeddings)
+            with timed(timings, "assembly"):
+                recognized = assemble_recognized_faces(names, scores, roster)
+
+            counts["images"] += 1
+            counts["tiles"] += len(tiles)
+            counts["detections"] += len(detections)
+            counts["faces"] += len(faces)
+            counts["recognized"] += len(recognized)
+
+    counts["tiles_failed"] = sum(counts.pop("failed_sources", {}).values())
+    total = sum(timings.values())
+    return {
+        "stages": {stage: timings[stage] for stage in STAGES},
+        "total": total,
+        "counts": dict(counts),
+        "tiles_per_s": counts["tiles"] / total if total else 0.0,
+        "faces_per_s": counts["faces"] / total if total else 0.0,
+    }
+
+
+def summarize(runs):
+    summary = {}
+    for key in STAGES + ("total",):
+        values = [run["stages"][key] if key in STAGES else run[key] for run in runs]
+        summary[key] = {"min": min(values), "median": statistics.median(values), "mean": statistics.fmean(values)}
+    summary["tiles_per_s"] = statistics.median(run["tiles_per_s"] for run in runs)
+    summary["faces_per_s"] = statistics.median(run["faces_per_s"] for run in runs)
+    return summary
+
+
+def cold_run(folder, encoding_file, csv_path, batch_size):
+    """Run one pass over a set in a fresh interpreter, so model loading is included."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        out = tmp.name
+    try:
+        subprocess.run(
+            [sys.executable, "-m", "metrics.benchmark", "--sets", folder, "--repeat", "1", "--no-cold",
+             "--no-warmup", "--encoding-file", encoding_file, "--csv", csv_path,
+             "--batch-size", str(batch_size), "--out", out],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        with open(out) as f:
+            report = json.load(f)
+    finally:
+        os.remove(out)
+    result = report["sets"][folder]
+    run = result["runs"][0]
+    run["peak_rss_mb"] = report["peak_rss_mb"]
+    return run
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the recognition pipeline")
+    parser.add_argument("--sets", nargs="+", default=list(DEFAULT_SETS), help="image folders to run")
+    parser.add_argument("--repeat", type=int, default=3, help="warm repetitions per set")
+    parser.add_argument("--out", default="bench.json", help="JSON report path")
+    parser.add_argument("--encoding-file", default=GALLERY_DIR)
+    parser.add_argument("--csv", default="Data/dataset_copy.csv")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-cold", action="store_true", help="skip the fresh-process cold runs")
+    parser.add_argument("--no-warmup", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    gallery = get_gallery(args.encoding_file)
+    if not gallery.refresh():
+        parser.error(f"encoding file '{args.encoding_file}' not found")
+    roster = get_roster(args.csv)
+    gallery_load = time.perf_counter() - started
+
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "model": MODEL_NAME,
+            "batch_size": args.batch_size,
+            "inference_batching": INFERENCE_BATCHING,
+            "micro_batch_size": MICRO_BATCH_SIZE,
+            "enhance_faces": ENHANCE_FACES,
+            "index": FACE_INDEX,
+            "grid_sizes": list(GRID_SIZES),
+            "gallery_size": len(gallery),
+            "gallery_load_s": gallery_load,
+        },
+        "sets": {},
+    }
+
+    for folder in args.sets:
+        paths = list_images(folder)
+        print(f"[Info] {folder}: {len(paths)} images")
+        result = {"images": len(paths), "runs": []}
+
+        if not args.no_cold:
+            run = cold_run(folder, args.encoding_file, args.csv, args.batch_size)
+            run["kind"] = "cold"
+            result["runs"].append(run)
+            print(f"[Cold] {folder}: {run['total']:.2f}s")
+
+        if not args.no_warmup:
+            run_once(paths, gallery, roster, args.batch_size)
+
+        warm = []
+        for i in range(args.repeat):
+            run = run_once(paths, gallery, roster, args.batch_size)
+            run["kind"] = "warm"
+            warm.append(run)
+            print(f"[Warm {i + 1}/{args.repeat}] {folder}: {run['total']:.2f}s, "
+                  f"{run['tiles_per_s']:.1f} tiles/s, {run['faces_per_s']:.1f} faces/s")
+
+        result["runs"].extend(warm)
+        if warm:
+            result["summary"] = summarize(warm)
+        report["sets"][folder] = result
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Info] Benchmark report saved to '{args.out}' (peak RSS {report['peak_rss_mb']:.0f} MB).")
+
+
+if __name__ == "__main__":
+    main()
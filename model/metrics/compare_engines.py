@@ -0,0 +1,175 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import statistics
+import time
+from itertools import combinations
+
+from deepface_model.engines import ENGINES, DeepFaceEngine, get_engine
+from deepface_model.roster import ROSTER_CSV
+from metrics.benchmark import DEFAULT_SETS, GRID_SIZES, git_commit, list_images
+
+# Runs the same photos through every recognition engine and compares their
+# per-photo latency and the students they recognize:
+#
+#   python -m metrics.compare_engines --labels labels.csv --out compare.json
+#
+# labels.csv is optional ground truth with an "image" column and a "names"
+# column of the students in that photo separated by ';'. Photos are keyed by
+# their path as listed (e.g. test/a.jpg); a bare file name in the labels
+# applies to every photo with that name. With it, each
+# engine gets precision and recall; without it, only agreement between the
+# engines is reported. The DeepFace result cache is off, so every photo is
+# actually processed.
+
+
+def load_labels(path):
+    """{image path or file name: set of student names} from a labels CSV."""
+    with open(path, newline='') as f:
+        return {
+            os.path.normpath(row["image"].strip()): {name.strip() for name in row["names"].split(";") if name.strip()}
+            for row in csv.DictReader(f)
+        }
+
+
+def photo_labels(photo, labels):
+    """The labelled names for a photo key, by its path or else its file name."""
+    return labels.get(photo, labels.get(os.path.basename(photo)))
+
+
+def run_engine(engine, paths, csv_path):
+    """Recognize every photo separately; returns per-photo names, seconds, and face counts."""
+    photos = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The first photo loads models and traces graphs; it is run once untimed
+        if paths:
+            with open(paths[0], 'rb') as f:
+                engine.recognize_uploads([(os.path.basename(paths[0]), f.read())], GRID_SIZES, csv_path)
+
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            stats = {}
+            started = time.perf_counter()
+            recognized = engine.recognize_uploads([(os.path.basename(path), data)], GRID_SIZES, csv_path, stats=stats)
+            # Keyed by path, so same-named photos in different sets stay apart
+            photos[os.path.normpath(path)] = {
+                "seconds": time.perf_counter() - started,
+                "faces": stats.get("unique_faces", 0),
+                "names": sorted(face["name"] for face in recognized),
+            }
+    return photos
+
+
+def latency_summary(photos):
+    seconds = sorted(photo["seconds"] for photo in photos.values())
+    if not seconds:
+        return {}
+    total = sum(seconds)
+    return {
+        "total_s": round(total, 3),
+        "images_per_s": round(len(seconds) / total, 3) if total else 0.0,
+        "mean_s": round(statistics.fmean(seconds), 3),
+        "p50_s": round(seconds[len(seconds) // 2], 3),
+        "p95_s": round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], 3),
+        "faces": sum(photo["faces"] for photo in photos.values()),
+        "recognized": sum(len(photo["names"]) for photo in photos.values()),
+    }
+
+
+def accuracy(photos, labels):
+    """Micro-averaged precision and recall over the labelled photos."""
+    hits = found = expected = labelled = 0
+    for image, photo in photos.items():
+        names = photo_labels(image, labels)
+        if names is None:
+            continue
+        recognized = set(photo["names"])
+        hits += len(recognized & names)
+        found += len(recognized)
+        expected += len(names)
+        labelled += 1
+    return {
+        "labelled_images": labelled,
+        "precision": round(hits / found, 4) if found else None,
+        "recall": round(hits / expected, 4) if expected else None,
+    }
+
+
+def agreement(a, b):
+    """How often two engines recognize the same students in the same photos."""
+    jaccard = []
+    only_a = only_b = 0
+    for image in a.keys() & b.keys():
+        names_a, names_b = set(a[image]["names"]), set(b[image]["names"])
+        union = names_a | names_b
+        jaccard.append(len(names_a & names_b) / len(union) if union else 1.0)
+        only_a += len(names_a - names_b)
+        only_b += len(names_b - names_a)
+    return {
+        "images": len(jaccard),
+        "mean_jaccard": round(statistics.fmean(jaccard), 4) if jaccard else None,
+        "identical_images": sum(value == 1.0 for value in jaccard),
+        "only_first": only_a,
+        "only_second": only_b,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare recognition engines side by side")
+    parser.add_argument("--sets", nargs="+", default=list(DEFAULT_SETS), help="image folders to run")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--labels", help="ground-truth CSV with image and names columns")
+    parser.add_argument("--csv", default=ROSTER_CSV, help="roster CSV")
+    parser.add_argument("--out", default="compare.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    paths = [path for folder in args.sets for path in list_images(folder)]
+    labels = load_labels(args.labels) if args.labels else None
+    print(f"[Info] {len(paths)} images from {', '.join(args.sets)}")
+
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "sets": args.sets,
+            "grid_sizes": list(GRID_SIZES),
+        },
+        "engines": {},
+        "agreement": {},
+    }
+    results = {}
+    for name in args.engines:
+        engine = DeepFaceEngine(result_cache=False) if name == "deepface" else get_engine(name)
+        if engine.load_gallery() is None:
+            print(f"[Warning] Skipping {name}: no gallery at '{engine.encoding_file}'")
+            continue
+
+        photos = results[name] = run_engine(engine, paths, args.csv)
+        summary = {"threshold": engine.threshold, "gallery": engine.encoding_file, **latency_summary(photos)}
+        if labels:
+            summary.update(accuracy(photos, labels))
+        report["engines"][name] = {"summary": summary, "photos": photos}
+
+        line = (f"[Info] {name}: {summary.get('images_per_s', 0)} images/s, p50 {summary.get('p50_s')}s, "
+                f"p95 {summary.get('p95_s')}s, {summary.get('faces', 0)} faces, {summary.get('recognized', 0)} recognized")
+        if labels:
+            line += f", precision {summary['precision']}, recall {summary['recall']}"
+        print(line)
+
+    for first, second in combinations(results, 2):
+        pair = report["agreement"][f"{first}/{second}"] = agreement(results[first], results[second])
+        print(f"[Info] {first} vs {second}: mean Jaccard {pair['mean_jaccard']}, identical on "
+              f"{pair['identical_images']}/{pair['images']} images, {pair['only_first']} names only from "
+              f"{first}, {pair['only_second']} only from {second}")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Info] Comparison report saved to '{args.out}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,137 @@
 import cv2
+import io
+import math
+import numpy as np
 import os
 import shutil
+from PIL import Image
 
-def split_image(image_path, output_folder, grid_size):
-    image = cv2.imread(image_path)
+# Decode policy: the finest grid's tiles only need to be about TILE_TARGET_SIZE
+# pixels on their long side for the detector, and no working image may exceed
+# MAX_WORKING_PIXELS, which bounds the decode memory per uploaded photo.
+TILE_TARGET_SIZE = int(os.getenv("TILE_TARGET_SIZE", "640"))
+MAX_WORKING_PIXELS = int(os.getenv("MAX_WORKING_PIXELS", "12000000"))
+REDUCED_DECODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def image_dimensions(data):
+    """Read (width, height) from the image header without decoding the pixels.
+
+    Returns None for headers PIL cannot read (decode_image rejects those); raises DecompressionBombError
+    for images too large to decode safely.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+def working_scale(width, height, grid_sizes=(3, 4), tile_target=TILE_TARGET_SIZE, max_pixels=MAX_WORKING_PIXELS):
+    """Downscale factor (at most 1) for an image of the given size."""
+    scale = min(1.0, tile_target * max(grid_sizes) / max(width, height))
+    if max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    return scale
+
+def decode_image(data, grid_sizes=(3, 4), tile_target=TILE_TARGET_SIZE, max_pixels=MAX_WORKING_PIXELS):
+    """Decode an upload at the working resolution; returns (image, scale) or (None, None).
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 size by libjpeg (IMREAD_REDUCED_*) when
+    that still covers the working resolution, so full-size pixels are never
+    materialized; an area resize then lands on the exact target. `scale` is
+    working size / original size and maps boxes back to the original photo.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None, None
+
+    try:
+        size = image_dimensions(data)
+    except Image.DecompressionBombError as e:
+        # A full-resolution decode is exactly what max_pixels is there to prevent
+        print(f"[Warning] Rejected oversized image: {e}")
+        return None, None
+    if size is None:
+        # Without a size the decode could not be bounded, so the upload is rejected
+        print("[Warning] Rejected image: its header could not be read")
+        return None, None
+
+    # The long side is used throughout, so EXIF rotation does not matter
+    original = max(size)
+    scale = working_scale(size[0], size[1], grid_sizes, tile_target, max_pixels)
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced in REDUCED_DECODES:
+        if scale <= 1 / factor:
+            flag = reduced
+            break
+
+    image = cv2.imdecode(buffer, flag)
     if image is None:
-        print(f"[ERROR] Could not load image: {image_path}")
-        return
+        return None, None
 
-    image_name = os.path.splitext(os.path.basename(image_path))[0]
-    height, width, _ = image.shape
+    height, width = image.shape[:2]
+    target = max(1, round(original * scale))
+    if max(width, height) > target:
+        ratio = target / max(width, height)
+        image = cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+
+    return image, max(image.shape[:2]) / original
+
+def iter_tiles(image, grid_size):
+    """Yield ((x, y, w, h), tile) for each grid cell; tiles are views, not copies."""
+    height, width = image.shape[:2]
     tile_height = height // grid_size
     tile_width = width // grid_size
 
-    count = 0
     for i in range(grid_size):
         for j in range(grid_size):
             x_start, y_start = j * tile_width, i * tile_height
-            x_end, y_end = x_start + tile_width, y_start + tile_height
-            tile = image[y_start:y_end, x_start:x_end]
+            yield (x_start, y_start, tile_width, tile_height), image[y_start:y_start + tile_height, x_start:x_start + tile_width]
+
+def tile_image(image, image_name, grid_sizes=(3, 4), scale=1.0):
+    """Split an in-memory image into tiles for every grid size, without touching disk.
+
+    `scale` is the decode scale of `image`, carried on every tile so detections
+    can be reported in the coordinates of the original photo.
+    """
+    tiles = []
+    height, width = image.shape[:2]
+    for grid_size in grid_sizes:
+        for count, (box, tile) in enumerate(iter_tiles(image, grid_size)):
+            tiles.append({
+                "name": f"{image_name}_size_{grid_size}_tile_{count}",
+                "source": image_name,
+                "grid_size": grid_size,
+                "box": box,
+                "image_size": (width, height),
+                "scale": scale,
+                "image": tile,
+            })
+    return tiles
+
+def split_image(image_path, output_folder, grid_sizes=(3, 4)):
+    """Save the tiles of every grid size as PNGs (debug mode).
+
+    The image is decoded once at the same working resolution the API uses,
+    so the tiles on disk are exactly the ones recognition processes.
+    """
+    with open(image_path, 'rb') as f:
+        image, scale = decode_image(f.read(), grid_sizes)
+    if image is None:
+        print(f"[ERROR] Could not load image: {image_path}")
+        return
+
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
 
-            tile_filename = os.path.join(
-                output_folder, f"{image_name}_size_{grid_size}_tile_{count}.png"
-            )
-            saved = cv2.imwrite(tile_filename, tile)
-            print(f"[Saved] {tile_filename}, Success: {saved}")
-            count += 1
+    for tile in tile_image(image, image_name, grid_sizes, scale):
+        tile_filename = os.path.join(output_folder, f"{tile['name']}.png")
+        saved = cv2.imwrite(tile_filename, tile["image"])
+        print(f"[Saved] {tile_filename}, Success: {saved}")
 
 def delete_directory(directory='output'):
     if os.path.exists(directory):
@@ -43,5 +149,4 @@ if __name__ == "__main__":
     #     if filename.lower().endswith((".jpg", ".jpeg", ".png")):
     #         image_path = os.path.join(TEST_FOLDER, filename)
     #         print(f"\n[PROCESSING] {image_path}")
-    #         split_image(image_path, OUTPUT_FOLDER, grid_size=3)
-    #         split_image(image_path, OUTPUT_FOLDER, grid_size=4)
+    #         split_image(image_path, OUTPUT_FOLDER, grid_sizes=(3, 4))
@@ -1,9 +1,10 @@
-import cv2
-import face_recognition
-import pandas as pd
-import numpy as np
+# face_recognition (dlib) and pandas are imported where they are used, so
+# importing the package, or any module in it, does not load them
 
 def load_dataset(excel_file):
+    import face_recognition
+    import pandas as pd
+
     df = pd.read_excel(excel_file)
     face_encodings = []
     emails = []
@@ -23,6 +24,8 @@ def load_dataset(excel_file):
     return face_encodings, emails
 
 def find_matching_faces(input_image, dataset_encodings, dataset_emails):
+    import face_recognition
+
     input_img = face_recognition.load_image_file(input_image)
     input_face_locations = face_recognition.face_locations(input_img)
     input_encodings = face_recognition.face_encodings(input_img, input_face_locations)
@@ -1,6 +1,7 @@
 import cv2
 import os
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from deepface_model.enhancement import ENHANCE_THREADS, enhance_array
 
 
 def enhance_image(image_path, output_path):
@@ -9,12 +10,8 @@ def enhance_image(image_path, output_path):
         print(f"Could not read {image_path}")
         return
 
-    # Resize image to a higher resolution (e.g., 2x original size)
-    image = cv2.resize(image, (0, 0), fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-
-    # Apply sharpening filter
-    kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    image = cv2.filter2D(image, -1, kernel)
+    # Resize image to a higher resolution (2x original size) and sharpen it
+    image = enhance_array(image, scale=2)
 
     # Convert to RGB if the image is grayscale (for compatibility)
     if len(image.shape) == 2 or image.shape[2] == 1:  # Grayscale image
@@ -25,15 +22,19 @@ def enhance_image(image_path, output_path):
     print(f"Enhanced image saved at {output_path}")
 
 
-def process_directory(input_dir, output_dir):
+def process_directory(input_dir, output_dir, threads=ENHANCE_THREADS):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    for filename in os.listdir(input_dir):
-        if filename.endswith(('.jpg', '.jpeg', '.png')):
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, filename)
-            enhance_image(input_path, output_path)
+    tasks = [
+        (os.path.join(input_dir, filename), os.path.join(output_dir, filename))
+        for filename in os.listdir(input_dir)
+        if filename.endswith(('.jpg', '.jpeg', '.png'))
+    ]
+
+    # Decoding, resizing and encoding all release the GIL, so threads scale
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        list(executor.map(lambda task: enhance_image(*task), tasks))
 
 
 if __name__ == "__main__":
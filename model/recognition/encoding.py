@@ -0,0 +1,7 @@
+def encode_image_file(image_path):
+    """Return the first face encoding in an image, or None if no face is found."""
+    import face_recognition
+
+    image = face_recognition.load_image_file(image_path)
+    encoding = face_recognition.face_encodings(image)
+    return encoding[0] if encoding else None
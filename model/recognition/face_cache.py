@@ -1,21 +1,27 @@
-import pickle
 import os
+import shutil
+from deepface_model.gallery_store import open_gallery, save_gallery
 
-CACHE_FILE = "face_encodings_cache.pkl"
+CACHE_DIR = "face_encodings_cache"
 
-def save_encodings_to_cache(encodings, names):
-    """Save face encodings and names to a pickle file for caching."""
-    with open(CACHE_FILE, "wb") as cache_file:
-        pickle.dump((encodings, names), cache_file)
+def save_encodings_to_cache(encodings, names, dataset_hash=None):
+    """Save face encodings and names to the shared gallery format for caching."""
+    save_gallery(CACHE_DIR, names, encodings, model_name="dlib", metric="l2", dataset_hash=dataset_hash)
 
-def load_encodings_from_cache():
-    """Load face encodings and names from the pickle cache file."""
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "rb") as cache_file:
-            return pickle.load(cache_file)
-    return None, None
+def load_encodings_from_cache(dataset_hash=None):
+    """Load face encodings (a memory-mapped array) and names from the cache.
+
+    With dataset_hash, a cache built from different data counts as missing.
+    """
+    try:
+        header, names, _, encodings = open_gallery(CACHE_DIR)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if dataset_hash is not None and header.get("dataset_hash") != dataset_hash:
+        return None, None
+    return encodings, names
 
 def clear_cache():
-    """Delete the cache file if needed."""
-    if os.path.exists(CACHE_FILE):
-        os.remove(CACHE_FILE)
+    """Delete the cache directory if needed."""
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
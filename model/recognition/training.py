@@ -1,60 +1,128 @@
-import face_recognition
-import cv2
 import numpy as np
-import pandas as pd 
 import csv
 import os
 from collections import defaultdict
-from face_cache import save_encodings_to_cache, load_encodings_from_cache 
+from recognition.face_cache import save_encodings_to_cache, load_encodings_from_cache
+from deepface_model.gallery_store import dataset_hash
+from deepface_model.index import FACE_INDEX, build_index
+from deepface_model.parallel import ENROLL_WORKERS, run_pool
+from deepface_model.roster import ROSTER_CSV, image_columns
+from recognition.encoding import encode_image_file
 # from division import split_image_3, split_image_4, delete_directory # Import caching functions
 
 # Paths
-CSV_FILE = "Data/dataset.csv"  # Path to your CSV file
+# The roster the API uses, so the dlib gallery enrolls the same students and
+# images as the DeepFace one; set ROSTER_CSV=Data/dataset.csv for the old file
+CSV_FILE = ROSTER_CSV
 TEST_FOLDER = "test_folder"  # Folder containing test images
 
-# Load known faces and their names from cache or CSV
-known_face_encodings, known_face_names = load_encodings_from_cache()
-
-def load_faces_from_csv(csv_file):
-    global known_face_encodings, known_face_names
-    known_face_encodings = []
-    known_face_names = []
+# Known faces and their names; nothing is loaded at import time, call
+# load_known_faces() (upload_and_recognize does it on first use)
+known_face_encodings, known_face_names = None, None
 
+def read_dataset(csv_file):
+    """(name, image path) for every image listed in the CSV, or None if the CSV is missing."""
+    tasks = []
     try:
         with open(csv_file, newline='') as file:
-            reader = csv.reader(file)
-            next(reader)
+            reader = csv.reader(file, skipinitialspace=True)
+            header = [column.strip() for column in next(reader)]
+            # Image paths come from the image columns, as in deepface_model.main.train_faces
+            name_index = header.index("name") if "name" in header else 0
+            image_indexes = [header.index(column) for column in image_columns(header)]
             for row in reader:
-                if len(row) < 2:
+                if len(row) <= name_index or not row[name_index].strip():
                     print(f"Skipping invalid row: {row}")
                     continue
-                
-                name = row[0].strip()
-                image_paths = [path.strip() for path in row[1:] if path.strip()]
-                
-                for image_path in image_paths:
-                    try:
-                        image = face_recognition.load_image_file(image_path)
-                        encoding = face_recognition.face_encodings(image)
-                        if encoding:
-                            known_face_encodings.append(encoding[0])
-                            known_face_names.append(name)
-                        else:
-                            print(f"Warning: No face found in {image_path}")
-                    except Exception as e:
-                        print(f"Error loading {image_path}: {e}")
+
+                name = row[name_index].strip()
+                image_paths = [row[i].strip() for i in image_indexes if i < len(row) and row[i].strip()]
+                tasks.extend((name, image_path) for image_path in image_paths)
     except FileNotFoundError:
         print(f"CSV file '{csv_file}' not found!")
+        return None
+    return tasks
+
+def dataset_fingerprint(tasks):
+    """Hash of every (name, image) pair with the image's size and mtime; changes when the CSV or an image does."""
+    items = []
+    for name, image_path in tasks:
+        try:
+            stat = os.stat(image_path)
+            items.append(f"{name}:{image_path}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            items.append(f"{name}:{image_path}:missing")
+    return dataset_hash(items)
+
+def load_faces_from_csv(csv_file, workers=ENROLL_WORKERS, tasks=None):
+    global known_face_encodings, known_face_names
+    known_face_encodings = []
+    known_face_names = []
+
+    if tasks is None:
+        tasks = read_dataset(csv_file)
+    if tasks is None:
+        return
+
+    # Encode across a process pool; results come back in CSV order
+    results = run_pool(
+        encode_image_file,
+        [image_path for _, image_path in tasks],
+        workers=workers,
+        label="Encoding enrollment images",
+    )
+
+    for (name, image_path), (encoding, error) in zip(tasks, results):
+        if error is not None:
+            print(f"Error loading {image_path}: {error}")
+        elif encoding is None:
+            print(f"Warning: No face found in {image_path}")
+        else:
+            known_face_encodings.append(encoding)
+            known_face_names.append(name)
+
+def load_known_faces(csv_file=CSV_FILE, workers=ENROLL_WORKERS):
+    """Load known faces from the cache, re-encoding the dataset only when its fingerprint changed."""
+    global known_face_encodings, known_face_names
+    tasks = read_dataset(csv_file)
+    fingerprint = dataset_fingerprint(tasks) if tasks is not None else None
+
+    # Without the CSV there is nothing to compare against, so any cache will do
+    encodings, names = load_encodings_from_cache(fingerprint)
+    if encodings is not None and len(encodings) and names:
+        known_face_encodings, known_face_names = encodings, names
+        print("Loaded face encodings from cache.")
+        return known_face_encodings, known_face_names
+
+    print("Cache missing or out of date. Loading from CSV...")
+    load_faces_from_csv(csv_file, workers, tasks)
+    if tasks is not None:
+        save_encodings_to_cache(known_face_encodings, known_face_names, dataset_hash=fingerprint)
+    return known_face_encodings, known_face_names
+
+# Search index over known_face_encodings, rebuilt when the encodings are replaced
+_known_face_index = (None, None)
+
+def get_known_face_index():
+    global _known_face_index
+    if known_face_encodings is None:
+        load_known_faces()
+    encodings, index = _known_face_index
+    if encodings is not known_face_encodings:
+        vectors = np.asarray(known_face_encodings, dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        index = build_index(vectors, metric="l2", kind=FACE_INDEX)
+        _known_face_index = (known_face_encodings, index)
+    return index
 
-# If cache is empty, load from CSV and save to cache
-if not known_face_encodings or not known_face_names:
-    print("Cache not found. Loading from CSV...")
-    load_faces_from_csv(CSV_FILE)
-    save_encodings_to_cache(known_face_encodings, known_face_names)
-else:
-    print("Loaded face encodings from cache.")
 def upload_and_recognize(folder):
+    import cv2
+    import face_recognition
+    import pandas as pd
+
     similarity_scores = defaultdict(list)  # To store cumulative similarity scores per user
+    known_face_index = get_known_face_index()
 
     for file_name in os.listdir(folder):
         file_path = os.path.join(folder, file_name)
@@ -78,13 +146,12 @@ def upload_and_recognize(folder):
 
         current_image_names = []  # Avoid duplicate recognition in the same image
 
-        for face_encoding in face_encodings:
-            face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
+        best_indices, best_distances = known_face_index.search(face_encodings, k=1)
+
+        for best_match_index, best_match_distance in zip(best_indices[:, 0], best_distances[:, 0]):
             name = "Unknown"
             
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                best_match_distance = face_distances[best_match_index]
+            if best_match_index >= 0:
                 
                 # Define threshold for 80% match (0.4)
                 THRESHOLD = 0.4
@@ -138,6 +205,8 @@ def upload_and_recognize(folder):
     return list(similarity_scores.keys())
 
 if __name__ == "__main__":
+    load_known_faces(CSV_FILE)
+
     TEST_FOLDER = "test_folder"
     OUTPUT_FOLDER = "output"
 